@@ -0,0 +1,44 @@
+import re
+from typing import Any, Dict, Optional
+
+MONTH_RE = re.compile(r'^\d{4}-\d{2}')
+# An amount with optional sign, dollar sign, thousands commas and currency code
+AMOUNT_RE = re.compile(
+    r'^(-)?\s*\$?\s*(-)?\s*(\d{1,3}(?:,\d{3})+|\d*)(\.\d+)?\s*(?:[A-Za-z]{3})?$'
+)
+
+
+def amount_cents(value: Any) -> Optional[int]:
+    """
+    Convert a total such as '$12.34', '-$5', '1,234.50' or '12.50 USD' to
+    integer cents.
+
+    Returns:
+        The amount in cents, or None if the text is not a single amount
+        (e.g. '12.50 - 2.00' or '1.234,56')
+    """
+    match = AMOUNT_RE.match(str(value if value is not None else '').strip())
+    if not match or not (match.group(3) or match.group(4)):
+        return None
+    sign, inner_sign, whole, fraction = match.groups()
+    cents = round(float((whole or '0').replace(',', '') + (fraction or '')) * 100)
+    return -cents if sign or inner_sign else cents
+
+
+def receipt_cents(receipt: Dict[str, Any]) -> int:
+    """
+    Total of a receipt in cents: the normalized total_cents when present,
+    otherwise parsed from total_payment; 0 if there is no readable total.
+    """
+    cents = receipt.get('total_cents')
+    if isinstance(cents, int):
+        return cents
+    return amount_cents(receipt.get('total_payment')) or 0
+
+
+def receipt_month(date: Any) -> str:
+    """
+    'YYYY-MM' of a receipt date, or '' if the date is missing or malformed.
+    """
+    match = MONTH_RE.match(str(date or ''))
+    return match.group(0) if match else ''
@@ -1,36 +1,58 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory, send_file
+from flask import Flask, Request, render_template, request, jsonify, session, redirect, url_for, send_file, Response, stream_with_context
 from flask_cors import CORS
 import os
-from werkzeug.utils import secure_filename
 import sys
 import json
 from datetime import datetime
-import uuid
-from openai import OpenAI
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Add backend directory to Python path
 sys.path.append('backend')
 
-from image_to_text import extract_text_from_file
-from text_scrapper import parse_receipt_text, format_receipt_data
-from chat_assistant import process_chat_request
+from text_scrapper import PARSE_BATCH_SIZE
+from chat_assistant import (process_chat_request, build_chat_messages, stream_chat_response,
+                            response_cache, response_cache_key, NO_RECEIPTS_MESSAGE, ERROR_PREFIX)
+from chat_context import ReceiptIndex
+from chat_router import answer_locally
+import storage
+import reports
+import thumbnails
+import upload_store
+import openai_client
+from jobs import JobQueue
+from receipt_pipeline import RECEIPT_STAGES, ocr_stage, parse_stage, parse_batch_stage, get_content_cache
+
+class UploadRequest(Request):
+    """Request whose body size limit a view may raise before reading the form."""
+    _max_content_length = None
+
+    @property
+    def max_content_length(self):
+        if self._max_content_length is not None:
+            return self._max_content_length
+        return super().max_content_length
+
+    @max_content_length.setter
+    def max_content_length(self, value):
+        self._max_content_length = value
 
 app = Flask(__name__,
            template_folder='frontend/pages', 
            static_folder='frontend/css')      
+app.request_class = UploadRequest
 CORS(app)  # Enable CORS
 app.secret_key = 'your-secret-key-here'  # Change this to a secure secret key
 
 # Get the directory containing app.py (backend), then go one level up to the project root
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'database', 'uploads')  # Store files in database/uploads
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['UPLOAD_FOLDER'] = upload_store.UPLOAD_DIR  # Store files in database/uploads
+UPLOAD_MAX_BYTES = int(os.getenv('EERIS_UPLOAD_MAX_BYTES', str(16 * 1024 * 1024)))
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES  # 16MB max file size
 
 # Database paths
+STORE_DB = os.getenv('EERIS_DB_PATH', os.path.join(BASE_DIR, 'database', 'eeris.db'))
+# Legacy JSON files, imported into the store once on first start
 USERS_DB = os.path.join(BASE_DIR, 'database', 'users.json')
 RECEIPTS_DB = os.path.join(BASE_DIR, 'database', 'receipts.json')
 
@@ -38,35 +60,74 @@ RECEIPTS_DB = os.path.join(BASE_DIR, 'database', 'receipts.json')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(os.path.join(BASE_DIR, 'database'), exist_ok=True)  # Use absolute path
 
-# Create database files if they don't exist
-if not os.path.exists(USERS_DB):
-    with open(USERS_DB, 'w') as f:
-        json.dump({"users": {}}, f)
-
-if not os.path.exists(RECEIPTS_DB):
-    with open(RECEIPTS_DB, 'w') as f:
-        json.dump({"receipts": {}}, f)
+storage.init_db(STORE_DB)
+storage.migrate_from_json(USERS_DB, RECEIPTS_DB)
+
+# Background receipt processing; results are kept in their own database
+JOBS_DB = os.getenv('EERIS_JOBS_DB_PATH', os.path.join(BASE_DIR, 'database', 'jobs.db'))
+job_queue = JobQueue(
+    JOBS_DB,
+    workers=int(os.getenv('EERIS_JOB_WORKERS', '2')),
+    use_processes=os.getenv('EERIS_JOB_EXECUTOR', 'thread') == 'process'
+)
+job_queue.register('process_receipt', RECEIPT_STAGES)
+job_queue.register('team_report', reports.REPORT_STAGES)
+# Latest background report job per supervisor, as (team data version, job id)
+report_jobs = {}
+jobs_recovered = False
+
+# Shared pool for /process_receipts_batch, bounding OCR/LLM work across requests
+BATCH_WORKERS = int(os.getenv('EERIS_BATCH_WORKERS', '4'))
+BATCH_MAX_FILES = int(os.getenv('EERIS_BATCH_MAX_FILES', '50'))
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='eeris-batch')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def load_users():
-    with open(USERS_DB, 'r') as f:
-        return json.load(f)
-
-def save_users(data):
-    with open(USERS_DB, 'w') as f:
-        json.dump(data, f, indent=2)
-
-def load_receipts():
-    with open(RECEIPTS_DB, 'r') as f:
-        return json.load(f)
+def upload_size(file):
+    """Size in bytes of an uploaded file, read from its spooled stream."""
+    stream = file.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+def store_upload(file):
+    """Save an uploaded file in the content-addressed store and return its job payload."""
+    file_extension = file.filename.rsplit('.', 1)[1].lower()
+    
+    # The hash names the file and keys the content cache, so repeat
+    # uploads are stored once and skip OCR and parsing
+    image_filename, filepath, content_hash = upload_store.save_upload(file.stream, file_extension)
+    return {
+        'filepath': filepath,
+        'image_filename': image_filename,
+        'content_hash': content_hash
+    }
 
-def save_receipts(data):
-    with open(RECEIPTS_DB, 'w') as f:
-        json.dump(data, f, indent=2)
+def get_team(username):
+    user = storage.get_user(username)
+    return user.get('team', []) if user else []
+
+def visible_usernames(username, role):
+    """Owners whose receipts the given user may see, or None for everyone."""
+    if role == 'admin':
+        return None
+    if role == 'supervisor':
+        return [username] + get_team(username)
+    return [username]
+
+@app.before_request
+def recover_jobs():
+    # Resume interrupted jobs in the process that actually serves requests,
+    # not in the debug reloader's watcher process
+    global jobs_recovered
+    if not jobs_recovered:
+        jobs_recovered = True
+        job_queue.recover()
 
 @app.route('/')
 def index():
@@ -89,13 +150,13 @@ def login():
     if not username or not password:
         return jsonify({'error': 'Username and password are required'}), 400
     
-    users = load_users()
+    user = storage.get_user(username)
     
-    if username not in users['users'] or users['users'][username]['password'] != password:
+    if user is None or user['password'] != password:
         return jsonify({'error': 'Invalid username or password'}), 401
     
     session['username'] = username
-    session['role'] = users['users'][username]['role']  
+    session['role'] = user['role']  
     return jsonify({'message': 'Login successful'})
 
 @app.route('/signup', methods=['GET', 'POST'])
@@ -109,19 +170,16 @@ def signup():
     role = data.get('role', 'user')
     team = data.get('team', [])  # Now team is a list of usernames
     
-    users = load_users()
-    
-    if username in users['users']:
-        return jsonify({'error': 'Username already exists'}), 400
-    
-    users['users'][username] = {
+    created = storage.create_user(username, {
         'password': password,
         'created_at': datetime.now().isoformat(),
         'role': role,
         'team': team if role == 'supervisor' else []
-    }
+    })
+    
+    if not created:
+        return jsonify({'error': 'Username already exists'}), 400
     
-    save_users(users)
     return jsonify({'message': 'Signup successful'})
 
 @app.route('/logout')
@@ -145,31 +203,148 @@ def process_receipt():
         return jsonify({'error': 'Invalid file type'}), 400
     
     try:
-        # Generate unique filename
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        
         # Save uploaded file
-        file.save(filepath)
+        payload = store_upload(file)
         
-        # Process the receipt
-        text = extract_text_from_file(filepath)
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            return jsonify({'error': 'OpenAI API key not set'}), 500
+        # Hand the work to the job queue and return straight away; the client
+        # polls status_url. async=0 keeps the old blocking behaviour.
+        if request.values.get('async', '1') not in ('0', 'false'):
+            job_id = job_queue.submit('process_receipt', session['username'], payload)
+            return jsonify({
+                'job_id': job_id,
+                'status_url': url_for('job_status', job_id=job_id)
+            }), 202
         
-        receipt_data = parse_receipt_text(text, api_key)
-        receipt_data['image_filename'] = unique_filename
+        # Process the receipt
+        extracted = ocr_stage(payload)
+        receipt_data = parse_stage(payload, extracted)
+        if thumbnails.EAGER_THUMBNAILS:
+            batch_pool.submit(thumbnails.generate_thumbnails, payload['filepath'])
         
-        return jsonify(receipt_data)
+        response = jsonify(receipt_data)
+        response.headers['X-Text-Source'] = extracted['text_source']
+        return response
         
     except Exception as e:
-        # Clean up file if there's an error
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        # The upload may be shared with other receipts; if none ends up
+        # referencing it, the upload garbage collector removes it
         return jsonify({'error': str(e)}), 500
 
+@app.route('/process_receipts_batch', methods=['POST'])
+def process_receipts_batch():
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    # The global limit is per file; a batch may carry up to BATCH_MAX_FILES
+    # of them, and files over the per-file limit are reported one by one
+    request.max_content_length = BATCH_MAX_FILES * UPLOAD_MAX_BYTES
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'At most {BATCH_MAX_FILES} files per batch'}), 400
+    
+    # Save everything up front so the uploads outlive the request body;
+    # files that cannot be stored are reported instead of failing the batch
+    results = []
+    futures = {}
+    for index, file in enumerate(files):
+        if not file.filename or not allowed_file(file.filename):
+            results.append({'index': index, 'filename': file.filename,
+                            'status': 'error', 'error': 'Invalid file type'})
+            continue
+        if upload_size(file) > UPLOAD_MAX_BYTES:
+            results.append({'index': index, 'filename': file.filename, 'status': 'error',
+                            'error': f'File is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)}MB'})
+            continue
+        try:
+            payload = store_upload(file)
+        except Exception as e:
+            results.append({'index': index, 'filename': file.filename,
+                            'status': 'error', 'error': str(e)})
+            continue
+        futures[batch_pool.submit(ocr_stage, payload)] = ('ocr', [(index, file.filename, payload)])
+    
+    def generate():
+        # One JSON object per line, in completion order. Files are OCRed
+        # concurrently; their texts are then parsed PARSE_BATCH_SIZE at a time
+        # so the LLM sees several receipts per request.
+        failed = len(results)
+        for result in results:
+            yield json.dumps(result) + '\n'
+        
+        pending = set(futures)
+        ocr_done = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, items = futures.pop(future)
+                if stage == 'ocr':
+                    try:
+                        ocr_done.append((items[0], future.result()))
+                        continue
+                    except Exception as e:
+                        outcomes = [e]
+                else:
+                    try:
+                        outcomes = future.result()
+                    except Exception as e:
+                        outcomes = [e] * len(items)
+                
+                for (index, filename, payload), outcome in zip(items, outcomes):
+                    if isinstance(outcome, dict):
+                        result = {'index': index, 'filename': filename,
+                                  'status': 'ok', 'receipt': outcome}
+                        if thumbnails.EAGER_THUMBNAILS:
+                            batch_pool.submit(thumbnails.generate_thumbnails, payload['filepath'])
+                    else:
+                        failed += 1
+                        result = {'index': index, 'filename': filename, 'status': 'error',
+                                  'error': str(outcome) if outcome else 'Could not parse receipt'}
+                    yield json.dumps(result) + '\n'
+            
+            # Flush full batches, and the remainder once no OCR is left to wait for
+            ocr_running = any(stage == 'ocr' for stage, _ in futures.values())
+            while ocr_done and (len(ocr_done) >= PARSE_BATCH_SIZE or not ocr_running):
+                chunk, ocr_done = ocr_done[:PARSE_BATCH_SIZE], ocr_done[PARSE_BATCH_SIZE:]
+                future = batch_pool.submit(parse_batch_stage,
+                                           [item[2] for item, _ in chunk],
+                                           [extracted for _, extracted in chunk])
+                futures[future] = ('parse', [item for item, _ in chunk])
+                pending.add(future)
+        
+        yield json.dumps({'done': True, 'total': len(files),
+                          'succeeded': len(files) - failed, 'failed': failed}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    job = job_queue.get(job_id)
+    if job is None or (job['username'] != session['username'] and session.get('role') != 'admin'):
+        return jsonify({'error': 'Job not found'}), 404
+    
+    job.pop('result', None)
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    job = job_queue.get(job_id)
+    if job is None or (job['username'] != session['username'] and session.get('role') != 'admin'):
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error']}), 500
+    if job['status'] != 'done':
+        return jsonify({'status': job['status'], 'stage': job['stage']}), 202
+    return jsonify(job['result'])
+
 @app.route('/save_receipt', methods=['POST'])
 def save_receipt():
     if 'username' not in session:
@@ -178,7 +353,8 @@ def save_receipt():
     try:
         receipt_data = request.get_json()
         
-        # Add metadata
+        # Add metadata; the id is fixed here and never changes afterwards
+        receipt_data['id'] = storage.new_receipt_id()
         receipt_data['processed_at'] = datetime.now().isoformat()
         receipt_data['status'] = 'submitted'
         
@@ -187,101 +363,166 @@ def save_receipt():
             receipt_data['image_filename'] = request.image_filename
         
         # Save to database
-        receipts = load_receipts()
-        if session['username'] not in receipts['receipts']:
-            receipts['receipts'][session['username']] = []
-            
-        receipts['receipts'][session['username']].append(receipt_data)
-        save_receipts(receipts)
+        receipt_id = storage.add_receipt(session['username'], receipt_data)
         
-        return jsonify({'message': 'Receipt saved successfully'})
+        return jsonify({'message': 'Receipt saved successfully', 'id': receipt_id})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/uploads/<filename>')
-def serve_receipt(filename):
+# Uploads are stored under unique names and never change, and neither do
+# their thumbnails, so browsers may keep them for a year without revalidating
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+def upload_access_error(filename):
+    """Return an error response if the current user may not see an upload, else None."""
     if 'username' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
+    # Admins have access to all receipts
+    current_role = session.get('role')
+    if current_role == 'admin':
+        return None
+    
+    # Everyone else needs to own the receipt, or supervise its owner
+    owners = storage.get_image_owners(filename)
+    if owners.isdisjoint(visible_usernames(session['username'], current_role)):
+        return jsonify({'error': 'Unauthorized'}), 403
+    return None
+
+@app.route('/uploads/<filename>')
+def serve_receipt(filename):
     try:
-        # Check if user has access to this receipt
-        receipts = load_receipts()
-        users = load_users()
-        has_access = False
-        current_user = session['username']
-        current_role = session.get('role')
-        
-        # Admins have access to all receipts
-        if current_role == 'admin':
-            has_access = True
-        elif current_role == 'supervisor':
-            # Supervisors can access their own receipts and their team's receipts
-            supervisor_team = users['users'][current_user].get('team', [])
-            # Check supervisor's own receipts
-            if current_user in receipts['receipts']:
-                has_access = any(receipt.get('image_filename') == filename for receipt in receipts['receipts'][current_user])
-            # Check team members' receipts
-            if not has_access:
-                for username in supervisor_team:
-                    if username in receipts['receipts']:
-                        has_access = any(receipt.get('image_filename') == filename for receipt in receipts['receipts'][username])
-                        if has_access:
-                            break
-        else:
-            # Regular users can only access their own receipts
-            user_receipts = receipts['receipts'].get(current_user, [])
-            has_access = any(receipt.get('image_filename') == filename for receipt in user_receipts)
-        
-        if not has_access:
-            return jsonify({'error': 'Unauthorized'}), 403
+        error = upload_access_error(filename)
+        if error:
+            return error
             
-        upload_path = os.path.join(os.path.dirname(__file__), app.config['UPLOAD_FOLDER'])
-        return send_from_directory(upload_path, filename)
+        path = upload_store.resolve(filename)
+        if not os.path.exists(path):
+            return jsonify({'error': 'File not found'}), 404
+        response = send_file(path, conditional=True)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/uploads/<filename>/thumbnail')
+def serve_thumbnail(filename):
+    """
+    Downscaled preview of an upload; the first page for PDFs.
+    
+    Query parameters: size, rounded up to one of thumbnails.SIZE_BUCKETS
+    (default the largest), and format, 'webp' or 'jpeg' (default WebP when
+    the Accept header allows it).
+    """
+    try:
+        error = upload_access_error(filename)
+        if error:
+            return error
+        
+        size = thumbnails.size_bucket(request.args.get('size', type=int))
+        fmt = request.args.get('format')
+        if fmt is None:
+            fmt = 'webp' if request.accept_mimetypes['image/webp'] else 'jpeg'
+        if fmt not in thumbnails.FORMATS:
+            return jsonify({'error': f'Unknown format: {fmt}'}), 400
+        
+        source_path = upload_store.resolve(filename)
+        if not os.path.exists(source_path):
+            return jsonify({'error': 'File not found'}), 404
+        
+        path = thumbnails.get_thumbnail(source_path, size, fmt)
+        response = send_file(path, mimetype=thumbnails.mimetype(fmt), conditional=True,
+                             etag=os.path.basename(path))
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept')
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def with_etag(response, etag):
+    # no-cache: browsers keep the body but revalidate it on every request,
+    # sending If-None-Match on their own
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/my_receipts')
 def my_receipts():
     if 'username' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    receipts = load_receipts()
-    current_user = session['username']
-    user_role = session.get('role')
-    
-    if user_role == 'admin':
-        # Admins see all receipts
-        all_receipts = []
-        for username, user_receipts in receipts['receipts'].items():
-            for receipt in user_receipts:
-                receipt['username'] = username
-            all_receipts.extend(user_receipts)
-        return jsonify(all_receipts)
-    elif user_role == 'supervisor':
-        # Supervisors see receipts from their team and their own receipts
-        users = load_users()
-        supervisor_team = users['users'][current_user].get('team', [])
-        
-        team_receipts = []
-        # Add supervisor's own receipts
-        if current_user in receipts['receipts']:
-            for receipt in receipts['receipts'][current_user]:
-                receipt['username'] = current_user
-                team_receipts.extend([receipt])
-            
-        # Add team members' receipts
-        for username in supervisor_team:
-            if username in receipts['receipts']:
-                for receipt in receipts['receipts'][username]:
-                    receipt['username'] = username
-                    team_receipts.append(receipt)
-        return jsonify(team_receipts)
-    else:
-        # Regular users see only their receipts
-        user_receipts = receipts['receipts'].get(current_user, [])
-        return jsonify(user_receipts)
+    # Admins see all receipts, supervisors their own and their team's,
+    # regular users only their own
+    usernames = visible_usernames(session['username'], session.get('role'))
+    
+    def listed(name):
+        value = request.args.get(name)
+        return [item for item in value.split(',') if item] if value else []
+    
+    requested_users = listed('user')
+    if requested_users:
+        if usernames is not None and not set(requested_users) <= set(usernames):
+            return jsonify({'error': 'Unauthorized'}), 403
+        usernames = requested_users
+    
+    # Read the version before the data: a write in between only makes the
+    # client see the change twice, never miss it
+    version, _ = storage.listing_version(usernames)
+    etag = hashlib.sha256(json.dumps(
+        [storage.receipts_version(usernames), sorted(request.args.items(multi=True))]
+    ).encode()).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        return with_etag(Response(status=304), etag)
+    
+    owners = storage.owners_fingerprint(usernames)
+    
+    # Without query parameters, keep returning the whole list as an array
+    if not request.args:
+        response = jsonify(storage.list_receipts(usernames))
+        response.headers['X-Receipts-Version'] = str(version)
+        response.headers['X-Receipts-Owners'] = owners
+        return with_etag(response, etag)
+    
+    # Delta sync: ?since=<version>&owners=<fingerprint> returns what was added
+    # or changed after that version. If the visible owners have changed since
+    # (e.g. a supervisor gained a team member), or the fingerprint is missing,
+    # older receipts may be new to the client: send everything with full=true
+    # so it replaces its copy instead of merging.
+    if 'since' in request.args:
+        try:
+            since = int(request.args['since'])
+        except ValueError:
+            return jsonify({'error': 'since must be an integer version'}), 400
+        if request.args.get('owners') != owners:
+            return with_etag(jsonify({'receipts': storage.list_receipts(usernames), 'version': version,
+                                      'owners': owners, 'full': True}), etag)
+        receipts, latest = storage.receipts_changed_since(usernames, since)
+        return with_etag(jsonify({'receipts': receipts, 'version': latest,
+                                  'owners': owners, 'full': False}), etag)
+    
+    # Otherwise return one page:
+    # ?limit=50&cursor=..&status=approved,denied&category=meals&user=harold
+    # &date_from=2025-01-01&date_to=2025-03-31&sort=date&order=desc&fields=store_name,total_payment
+    try:
+        receipts, next_cursor = storage.query_receipts(
+            usernames,
+            statuses=listed('status'),
+            categories=listed('category'),
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            sort=request.args.get('sort', 'submitted'),
+            descending=request.args.get('order', 'asc') == 'desc',
+            limit=request.args.get('limit', 50),
+            cursor=request.args.get('cursor'),
+            fields=listed('fields') or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return with_etag(jsonify({'receipts': receipts, 'next_cursor': next_cursor,
+                              'version': version, 'owners': owners}), etag)
 
 @app.route('/check_role')
 def check_role():
@@ -289,6 +530,104 @@ def check_role():
         return jsonify({'error': 'Not authenticated'}), 401
     return jsonify({'role': session.get('role', 'user')})
 
+@app.route('/cache_stats')
+def cache_stats():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({
+        'storage': storage.cache_stats(),
+        'content': get_content_cache().stats(),
+        'chat_responses': response_cache.stats()
+    })
+
+@app.route('/gc_uploads', methods=['GET', 'POST'])
+def gc_uploads():
+    """Remove uploads no receipt refers to; GET only reports what POST would remove."""
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    try:
+        grace_hours = request.values.get('grace_hours', type=float)
+        report = upload_store.collect_garbage(
+            storage.referenced_images(),
+            grace_hours * 3600 if grace_hours is not None else None,
+            dry_run=request.method == 'GET'
+        )
+        return jsonify(report)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/llm_stats')
+def llm_stats():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(openai_client.stats())
+
+@app.route('/analytics')
+def analytics():
+    """Spending totals over the caller's visible receipts, served from the rollups."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        usernames = visible_usernames(session['username'], session.get('role'))
+        # Optional exact-match filters, e.g. ?status=approved&month=2025-03
+        filters = {name: request.args[name] for name in ('category', 'month', 'status')
+                   if name in request.args}
+        if 'user' in request.args:
+            if usernames is not None and request.args['user'] not in usernames:
+                return jsonify({'error': 'Unauthorized'}), 403
+            usernames = [request.args['user']]
+        
+        def money(rows):
+            for row in rows:
+                row['amount'] = f"${row['cents'] / 100:.2f}"
+            return rows
+        
+        totals = storage.rollup_totals(usernames, **filters)
+        by_user = money(storage.rollup_totals(usernames, ['username'], **filters))
+        result = {
+            'totals': money(totals)[0] if totals else {'count': 0, 'cents': 0, 'amount': '$0.00'},
+            'by_user': by_user,
+            'by_category': money(storage.rollup_totals(usernames, ['category'], **filters)),
+            'by_month': money(storage.rollup_totals(usernames, ['month'], **filters)),
+            'by_status': money(storage.rollup_totals(usernames, ['status'], **filters)),
+        }
+        
+        # Per team: supervisors' teams, plus the supervisor themselves
+        user_totals = {row['username']: row for row in by_user}
+        teams = []
+        for supervisor, user in storage.list_users(role='supervisor').items():
+            members = [supervisor] + user.get('team', [])
+            if usernames is not None and supervisor not in usernames:
+                continue
+            rows = [user_totals[member] for member in members if member in user_totals]
+            teams.append({
+                'supervisor': supervisor,
+                'count': sum(row['count'] for row in rows),
+                'cents': sum(row['cents'] for row in rows)
+            })
+        result['by_team'] = money(teams)
+        return jsonify(result)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def can_review(owner):
+    """Whether the current user may approve or deny receipts of the given owner."""
+    current_user = session['username']
+    current_role = session.get('role')
+    
+    if current_role == 'admin':
+        # Admins can update any receipt
+        return True
+    if current_role == 'supervisor':
+        # Supervisors can update their own receipts and their team's receipts
+        return owner == current_user or owner in get_team(current_user)
+    return False
+
 @app.route('/update_receipt_status', methods=['POST'])
 def update_receipt_status():
     if 'username' not in session:
@@ -303,39 +642,21 @@ def update_receipt_status():
         if not all([username, processed_at, new_status]):
             return jsonify({'error': 'Missing required fields'}), 400
             
-        receipts = load_receipts()
-        users = load_users()
-        current_user = session['username']
-        current_role = session.get('role')
-        
-        # Check if user has permission to update status
-        has_permission = False
-        
-        if current_role == 'admin':
-            # Admins can update any receipt
-            has_permission = True
-        elif current_role == 'supervisor':
-            # Supervisors can update their own receipts and their team's receipts
-            supervisor_team = users['users'][current_user].get('team', [])
-            if username == current_user or username in supervisor_team:
-                has_permission = True
-        
-        if not has_permission:
+        if not can_review(username):
             return jsonify({'error': 'Unauthorized'}), 403
         
         # Find and update the receipt
-        user_receipts = receipts['receipts'].get(username, [])
-        for receipt in user_receipts:
-            if receipt['processed_at'] == processed_at:
-                receipt['status'] = new_status
-                save_receipts(receipts)
-                return jsonify({'message': 'Status updated successfully'})
+        if storage.set_receipt_status(username, processed_at, new_status):
+            return jsonify({'message': 'Status updated successfully'})
         
         return jsonify({'error': 'Receipt not found'}), 404
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Fields an edit never overwrites once set
+RECEIPT_PRESERVED_FIELDS = ['image_filename', 'processed_at', 'status']
+
 @app.route('/update_receipt', methods=['POST'])
 def update_receipt():
     try:
@@ -346,30 +667,75 @@ def update_receipt():
         username = data.get('username') or session['username']
         processed_at = data.get('processed_at')
 
-        # Load current receipts
-        with open(RECEIPTS_DB, 'r') as f:
-            receipts_data = json.load(f)
+        # Update receipt data while preserving certain fields
+        if storage.update_receipt(username, processed_at, data, RECEIPT_PRESERVED_FIELDS) is None:
+            return jsonify({'error': 'Receipt not found'}), 404
 
-        # Find and update the receipt
-        user_receipts = receipts_data['receipts'].get(username, [])
-        for receipt in user_receipts:
-            if receipt['processed_at'] == processed_at:
-                # Update receipt data while preserving certain fields
-                preserved_fields = ['image_filename', 'processed_at', 'status']
-                for field in preserved_fields:
-                    if field in receipt:
-                        data[field] = receipt[field]
-                
-                # Update the receipt with new data
-                receipt.update(data)
-                break
+        return jsonify({'message': 'Receipt updated successfully'})
 
-        # Save updated receipts
-        with open(RECEIPTS_DB, 'w') as f:
-            json.dump(receipts_data, f, indent=2)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        return jsonify({'message': 'Receipt updated successfully'})
+def visible_receipt(receipt_id):
+    """Return the receipt with this id if the current user may see it, else None."""
+    receipt = storage.get_receipt_by_id(receipt_id)
+    if receipt is None:
+        return None
+    owners = visible_usernames(session['username'], session.get('role'))
+    if owners is not None and receipt['username'] not in owners:
+        return None
+    return receipt
+
+@app.route('/receipts/<receipt_id>', methods=['GET'])
+def get_receipt(receipt_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        receipt = visible_receipt(receipt_id)
+        if receipt is None:
+            return jsonify({'error': 'Receipt not found'}), 404
+        return jsonify(receipt)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/receipts/<receipt_id>', methods=['POST'])
+def update_receipt_by_id(receipt_id):
+    """Id-addressed counterpart of /update_receipt."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        if visible_receipt(receipt_id) is None:
+            return jsonify({'error': 'Receipt not found'}), 404
+        
+        receipt = storage.update_receipt_by_id(receipt_id, request.get_json(), RECEIPT_PRESERVED_FIELDS)
+        if receipt is None:
+            return jsonify({'error': 'Receipt not found'}), 404
+        return jsonify({'message': 'Receipt updated successfully', 'receipt': receipt})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/receipts/<receipt_id>/status', methods=['POST'])
+def update_receipt_status_by_id(receipt_id):
+    """Id-addressed counterpart of /update_receipt_status."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        new_status = (request.get_json() or {}).get('status')
+        if not new_status:
+            return jsonify({'error': 'Missing required fields'}), 400
+        
+        receipt = visible_receipt(receipt_id)
+        if receipt is None:
+            return jsonify({'error': 'Receipt not found'}), 404
+        if not can_review(receipt['username']):
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        if storage.update_receipt_by_id(receipt_id, {'status': new_status}) is None:
+            return jsonify({'error': 'Receipt not found'}), 404
+        return jsonify({'message': 'Status updated successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -387,42 +753,25 @@ def chat():
             return jsonify({'error': 'No message provided'}), 400
         
         # Get receipts based on user role
-        receipts = load_receipts()
-        user_data = []
-        
-        if session.get('role') == 'admin':
-            # Admins see all receipts
-            for username, user_receipts in receipts['receipts'].items():
-                for receipt in user_receipts:
-                    receipt_with_user = receipt.copy()
-                    receipt_with_user['username'] = username
-                    user_data.append(receipt_with_user)
-        elif session.get('role') == 'supervisor':
-            # Supervisors see their own receipts and their team's receipts
-            users = load_users()
-            supervisor_team = users['users'][session['username']].get('team', [])
-            
-            # Add supervisor's own receipts
-            if session['username'] in receipts['receipts']:
-                for receipt in receipts['receipts'][session['username']]:
-                    receipt_with_user = receipt.copy()
-                    receipt_with_user['username'] = session['username']
-                    user_data.append(receipt_with_user)
-            
-            # Add team members' receipts
-            for username in supervisor_team:
-                if username in receipts['receipts']:
-                    for receipt in receipts['receipts'][username]:
-                        receipt_with_user = receipt.copy()
-                        receipt_with_user['username'] = username
-                        user_data.append(receipt_with_user)
-        else:
-            # Regular users see only their receipts
-            user_receipts = receipts['receipts'].get(session['username'], [])
-            for receipt in user_receipts:
-                receipt_with_user = receipt.copy()
-                receipt_with_user['username'] = session['username']
-                user_data.append(receipt_with_user)
+        usernames = visible_usernames(session['username'], session.get('role'))
+        user_data = storage.list_receipts(usernames)
+        
+        # Totals, counts and breakdowns are computed here; only open-ended
+        # questions reach OpenAI
+        answer = answer_locally(message, user_data, session['username'], storage.list_users())
+        if answer is not None:
+            return jsonify({'response': answer, 'answered_by': 'local'})
+        
+        # Repeated questions over unchanged receipts reuse the earlier answer
+        cache_key = response_cache_key(storage.receipts_version(usernames), message,
+                                       conversation_history, session['username'])
+        cached_answer = response_cache.get(cache_key)
+        if cached_answer is not None:
+            return jsonify({'response': cached_answer, 'answered_by': 'cache'})
+        
+        # The search index and totals are rebuilt only when receipts change
+        index_key = ('chat_index', None if usernames is None else tuple(usernames))
+        index = storage.cached(index_key, lambda: ReceiptIndex(user_data))
         
         # Get OpenAI API key
         api_key = os.getenv('OPENAI_API_KEY')
@@ -435,23 +784,93 @@ def chat():
             user_data=user_data, 
             api_key=api_key,
             conversation_history=conversation_history,
-            current_user=session['username']
+            current_user=session['username'],
+            index=index
         )
         
-        return jsonify({'response': response_text})
+        if user_data and not response_text.startswith(ERROR_PREFIX):
+            response_cache.put(cache_key, response_text)
+        return jsonify({'response': response_text, 'answered_by': 'llm'})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same request body as /chat; the answer is sent as server-sent events."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+        
+    try:
+        data = request.get_json()
+        message = data.get('message') if data else None
+        if not message:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        usernames = visible_usernames(session['username'], session.get('role'))
+        user_data = storage.list_receipts(usernames)
+        
+        answer = answer_locally(message, user_data, session['username'], storage.list_users())
+        if answer is None and not user_data:
+            answer = NO_RECEIPTS_MESSAGE
+        if answer is not None:
+            events = [sse_event('token', {'text': answer}),
+                      sse_event('done', {'answered_by': 'local', 'usage': None, 'timing': None})]
+            return Response(events, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+        
+        conversation_history = data.get('conversation_history', [])
+        cache_key = response_cache_key(storage.receipts_version(usernames), message,
+                                       conversation_history, session['username'])
+        cached_answer = response_cache.get(cache_key)
+        if cached_answer is not None:
+            events = [sse_event('token', {'text': cached_answer}),
+                      sse_event('done', {'answered_by': 'cache', 'usage': None, 'timing': None})]
+            return Response(events, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+        
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            return jsonify({'error': 'OpenAI API key not set'}), 500
+        
+        index_key = ('chat_index', None if usernames is None else tuple(usernames))
+        index = storage.cached(index_key, lambda: ReceiptIndex(user_data))
+        messages = build_chat_messages(
+            message, user_data, conversation_history, session['username'], index
+        )
+        # The stream below only needs the messages; drop this request's copies of
+        # the receipts (the cached index keeps only compact rows) rather than
+        # holding them for the whole generation
+        del user_data
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        parts = []
+        try:
+            for event, payload in stream_chat_response(messages, api_key):
+                if event == 'token':
+                    parts.append(payload['text'])
+                else:
+                    payload['answered_by'] = 'llm'
+                    # An empty answer would otherwise be replayed from cache
+                    if parts:
+                        response_cache.put(cache_key, ''.join(parts))
+                yield sse_event(event, payload)
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/get_users', methods=['GET'])
 def get_users():
     try:
-        users = load_users()
         # Only return users with 'user' role
         user_list = [
             {'username': username, 'role': data['role']}
-            for username, data in users['users'].items()
-            if data['role'] == 'user'
+            for username, data in storage.list_users(role='user').items()
         ]
         return jsonify({'users': user_list})
     except Exception as e:
@@ -471,27 +890,27 @@ def update_user_role():
         if not target_username or not new_role:
             return jsonify({'error': 'Username and role are required'}), 400
             
-        users = load_users()
+        user = storage.get_user(target_username)
         
-        if target_username not in users['users']:
+        if user is None:
             return jsonify({'error': 'User not found'}), 404
             
         # Get the current role before updating
-        current_role = users['users'][target_username]['role']
+        current_role = user['role']
         
         # Update the user's role
-        users['users'][target_username]['role'] = new_role
+        user['role'] = new_role
         
         # Handle team assignment
         if new_role == 'supervisor':
             # If changing to supervisor, set the team
-            users['users'][target_username]['team'] = team
+            user['team'] = team
         else:
             # If changing from supervisor or admin to any other role, clear the team
             if current_role in ['supervisor', 'admin']:
-                users['users'][target_username]['team'] = []
+                user['team'] = []
             
-        save_users(users)
+        storage.save_user(target_username, user)
         return jsonify({'message': 'Role updated successfully'})
         
     except Exception as e:
@@ -503,11 +922,10 @@ def get_user(username):
         return jsonify({'error': 'Unauthorized'}), 403
     
     try:
-        users = load_users()
-        if username not in users['users']:
+        user_data = storage.get_user(username)
+        if user_data is None:
             return jsonify({'error': 'User not found'}), 404
             
-        user_data = users['users'][username]
         return jsonify({
             'username': username,
             'role': user_data['role'],
@@ -522,90 +940,45 @@ def generate_team_report():
         return jsonify({'error': 'Unauthorized'}), 403
     
     try:
-        # Get supervisor's team
-        users = load_users()
-        supervisor_team = users['users'][session['username']].get('team', [])
-        
-        # Get all receipts for the team
-        receipts = load_receipts()
-        team_receipts = []
-        
-        # Add supervisor's own receipts
-        if session['username'] in receipts['receipts']:
-            for receipt in receipts['receipts'][session['username']]:
-                receipt['username'] = session['username']
-                team_receipts.append(receipt)
-        
-        # Add team members' receipts
-        for username in supervisor_team:
-            if username in receipts['receipts']:
-                for receipt in receipts['receipts'][username]:
-                    receipt['username'] = username
-                    team_receipts.append(receipt)
-        
-        # Create PDF
-        filename = f"team_report_{session['username']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        doc = SimpleDocTemplate(filepath, pagesize=letter)
-        elements = []
-        
-        # Add title
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            spaceAfter=30
-        )
-        title = Paragraph(f"Team Report for {session['username']}'s Team", title_style)
-        elements.append(title)
-        
-        # Prepare table data
-        table_data = [['Username', 'Date', 'Amount', 'Category', 'Status']]
-        for receipt in team_receipts:
-            # Format amount - remove $ if present and ensure proper decimal format
-            amount = receipt.get('total_payment', '0')
-            if amount:
-                # Remove any non-numeric characters except decimal point
-                amount = ''.join(c for c in amount if c.isdigit() or c == '.')
-                if not amount:
-                    amount = '0'
-                amount = f"${float(amount):.2f}"
-            else:
-                amount = '$0.00'
-                
-            table_data.append([
-                receipt['username'],
-                receipt.get('date', 'N/A'),
-                amount,
-                receipt.get('expense_category', 'N/A'),
-                receipt.get('status', 'N/A')
-            ])
-        
-        # Create table
-        table = Table(table_data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        elements.append(table)
-        doc.build(elements)
+        supervisor = session['username']
+        usernames = visible_usernames(supervisor, 'supervisor')
+        # Read the version first: a write in between makes the report newer
+        # than its name, never older
+        data_version = storage.receipts_version(usernames)
+        download_name = f"team_report_{supervisor}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        
+        # Unchanged team data: hand back the report generated last time
+        filepath = reports.cached_report(supervisor, data_version)
+        if filepath is None:
+            # Counted from the index; receipts are only loaded to build the
+            # report here, never just to decide where to build it
+            _, receipt_count = storage.listing_version(usernames)
+            if receipt_count > reports.BACKGROUND_ROWS:
+                # Large teams: build in the background, the client polls
+                # status_url and requests the report again once it is done
+                job_version, job_id = report_jobs.get(supervisor, (None, None))
+                job = job_queue.get(job_id) if job_version == data_version else None
+                if job is None or job['status'] == 'failed':
+                    job_id = job_queue.submit('team_report', supervisor, {
+                        'supervisor': supervisor,
+                        'usernames': usernames,
+                        'db_path': STORE_DB
+                    })
+                    report_jobs[supervisor] = (data_version, job_id)
+                return jsonify({
+                    'job_id': job_id,
+                    'status_url': url_for('job_status', job_id=job_id)
+                }), 202
+            
+            filepath = reports.build_team_report(
+                supervisor, storage.list_receipt_records(usernames),
+                reports.report_path(supervisor, data_version)
+            )
         
         return send_file(
             filepath,
             as_attachment=True,
-            download_name=filename,
+            download_name=download_name,
             mimetype='application/pdf'
         )
         
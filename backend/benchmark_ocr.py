@@ -0,0 +1,73 @@
+"""
+Compare OCR preprocessing presets on the sample receipts.
+
+For every image in the sample directory and every preset, reports the
+median preprocessing + OCR latency and how similar the text is to the
+unprocessed ('none') baseline.
+
+Usage:
+    python benchmark_ocr.py [--dir sample_receipts] [--presets none fast clean full] [--repeat 3]
+"""
+import argparse
+import difflib
+import os
+import statistics
+import time
+
+import pytesseract
+from PIL import Image
+
+from image_to_text import PREPROCESS_PRESETS, preprocess_image, tesseract_config
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def run_preset(path: str, preset: str) -> str:
+    image = preprocess_image(Image.open(path), **PREPROCESS_PRESETS[preset])
+    return pytesseract.image_to_string(image, config=tesseract_config()).strip()
+
+
+def similarity(a: str, b: str) -> float:
+    # Compare whitespace-normalised text so line wrapping differences do not count
+    return difflib.SequenceMatcher(None, ' '.join(a.split()), ' '.join(b.split())).ratio()
+
+
+def main():
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_receipts')
+    parser = argparse.ArgumentParser(description='Benchmark OCR preprocessing presets')
+    parser.add_argument('--dir', default=default_dir)
+    parser.add_argument('--presets', nargs='+', default=list(PREPROCESS_PRESETS))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    files = sorted(f for f in os.listdir(args.dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    totals = {preset: {'latency': [], 'similarity': []} for preset in args.presets}
+
+    print(f"{'file':<28} {'preset':<8} {'pixels':>10} {'ms':>8} {'similarity':>10}")
+    for filename in files:
+        path = os.path.join(args.dir, filename)
+        baseline = run_preset(path, 'none')
+
+        for preset in args.presets:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                text = run_preset(path, preset)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            width, height = preprocess_image(Image.open(path), **PREPROCESS_PRESETS[preset]).size
+            latency = statistics.median(timings)
+            score = similarity(baseline, text)
+            totals[preset]['latency'].append(latency)
+            totals[preset]['similarity'].append(score)
+            print(f"{filename:<28} {preset:<8} {width * height:>10} {latency:>8.0f} {score:>10.3f}")
+
+    print("\n=== Summary (mean over files) ===")
+    for preset, values in totals.items():
+        if values['latency']:
+            print(f"{preset:<8} {statistics.mean(values['latency']):>8.0f} ms"
+                  f"   similarity {statistics.mean(values['similarity']):.3f}")
+
+
+if __name__ == '__main__':
+    main()
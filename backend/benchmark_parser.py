@@ -0,0 +1,139 @@
+"""
+Compare receipt parse modes against the saved receipts.
+
+The saved receipts, read from the receipt store (or database/receipts.json
+before it exists), were parsed by the LLM and then reviewed by their
+owners, so they serve as the reference. For every saved receipt whose
+upload still exists, the upload's text is extracted once and then parsed
+with each mode. The script reports per-field accuracy and mean latency,
+and how many receipts hybrid mode parses without calling the LLM.
+
+Usage:
+    python benchmark_parser.py [--modes local hybrid llm]
+
+The hybrid and llm modes need OPENAI_API_KEY to be set.
+"""
+import argparse
+import collections
+import difflib
+import json
+import os
+import re
+import statistics
+import time
+
+import storage
+import upload_store
+from image_to_text import extract_text_from_file
+from text_scrapper import (PARSE_MODES, RECEIPT_SCHEMA, extract_fields_locally,
+                           parse_receipt_text, uncertain_fields)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE_DB = os.getenv('EERIS_DB_PATH', os.path.join(BASE_DIR, 'database', 'eeris.db'))
+RECEIPTS_JSON = os.path.join(BASE_DIR, 'database', 'receipts.json')
+
+
+def _digits(value: str) -> str:
+    return re.sub(r'\D', '', value or '')
+
+
+def _amount(value: str) -> str:
+    cleaned = ''.join(c for c in (value or '') if c.isdigit() or c == '.')
+    return f"{float(cleaned):.2f}" if cleaned else ''
+
+
+def _url(value: str) -> str:
+    return re.sub(r'^https?://(www\.)?', '', (value or '').lower()).rstrip('/')
+
+
+def _similar(a: str, b: str) -> bool:
+    return difflib.SequenceMatcher(None, (a or '').lower(), (b or '').lower()).ratio() >= 0.8
+
+
+def field_matches(field: str, expected, actual) -> bool:
+    if field == 'phone':
+        return _digits(expected)[-10:] == _digits(actual)[-10:]
+    if field == 'total_payment':
+        return _amount(expected) == _amount(actual)
+    if field == 'website':
+        return _url(expected) == _url(actual)
+    if field == 'line_items':
+        return _similar(' | '.join(expected or []), ' | '.join(actual or []))
+    if field in ('store_name', 'address', 'payment_method'):
+        return _similar(expected, actual) or (bool(actual) and actual.lower() in (expected or '').lower())
+    return (expected or '') == (actual or '')
+
+
+def load_receipts():
+    if os.path.exists(STORE_DB):
+        storage.init_db(STORE_DB)
+        return storage.list_receipts()
+    with open(RECEIPTS_JSON, 'r') as f:
+        receipts = json.load(f)['receipts']
+    return [receipt for user_receipts in receipts.values() for receipt in user_receipts]
+
+
+def load_samples():
+    # Texts are cached per upload; several receipts may share one file
+    texts = {}
+    samples = []
+    for receipt in load_receipts():
+        filename = receipt.get('image_filename')
+        try:
+            path = upload_store.resolve(filename)
+        except ValueError:
+            continue
+        if not os.path.exists(path):
+            continue
+        if filename not in texts:
+            try:
+                texts[filename] = extract_text_from_file(path)
+            except Exception as e:
+                print(f"Skipping {filename}: {e}")
+                texts[filename] = None
+        if texts[filename]:
+            samples.append((receipt, texts[filename]))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark receipt parse modes')
+    parser.add_argument('--modes', nargs='+', choices=PARSE_MODES,
+                        default=['local', 'hybrid', 'llm'] if os.getenv('OPENAI_API_KEY') else ['local'])
+    args = parser.parse_args()
+    api_key = os.getenv('OPENAI_API_KEY')
+
+    samples = load_samples()
+    print(f"{len(samples)} saved receipts with readable uploads")
+
+    # Which receipts hybrid mode would send to the LLM, and for what
+    needs_llm = [uncertain_fields(extract_fields_locally(text)[1]) for _, text in samples]
+    skipped = sum(1 for fields in needs_llm if not fields)
+    print(f"{skipped} of {len(samples)} parsed without an LLM call in hybrid mode")
+    reasons = collections.Counter(field for fields in needs_llm for field in fields)
+    if reasons:
+        print("  fields sent to the LLM: " + ', '.join(f"{field} ({count})" for field, count in reasons.most_common()))
+    print()
+    fields = list(RECEIPT_SCHEMA['properties'])
+
+    for mode in args.modes:
+        correct = {field: 0 for field in fields}
+        latencies = []
+        for receipt, text in samples:
+            start = time.perf_counter()
+            parsed = parse_receipt_text(text, api_key, mode=mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+            for field in fields:
+                correct[field] += field_matches(field, receipt.get(field), parsed.get(field))
+
+        if not samples:
+            break
+        print(f"=== {mode}: mean {statistics.mean(latencies):.1f} ms per receipt ===")
+        for field in fields:
+            print(f"  {field:<18} {correct[field] / len(samples):6.1%}")
+        overall = sum(correct.values()) / (len(samples) * len(fields))
+        print(f"  {'overall':<18} {overall:6.1%}\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+def file_signature(paths: List[str]) -> Tuple:
+    """
+    Build a cheap fingerprint of a set of files from their mtime and size.
+
+    Missing files contribute a placeholder, so a file appearing or
+    disappearing also changes the signature.
+
+    Args:
+        paths: Files to fingerprint
+
+    Returns:
+        Tuple that changes whenever any of the files is modified
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def prune_directory(directory: str, max_bytes: int, keep: Optional[List[str]] = None,
+                    suffixes: Tuple[str, ...] = ()) -> List[str]:
+    """
+    Delete the least recently used files until a directory fits max_bytes.
+
+    Files are ordered by access time; callers mark a hit by bumping it
+    with os.utime.
+
+    Args:
+        directory: Directory holding the cached files
+        max_bytes: Size the directory must fit in
+        keep: Files that must survive, e.g. the ones just written
+        suffixes: Only consider files with one of these endings (default all)
+
+    Returns:
+        Paths of the deleted files
+    """
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and (not suffixes or entry.name.endswith(suffixes)):
+            stat = entry.stat()
+            files.append((stat.st_atime, stat.st_size, entry.path))
+
+    kept = {os.path.abspath(path) for path in keep or []}
+    total = sum(size for _, size, _ in files)
+    removed = []
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in kept:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed.append(path)
+    return removed
+
+
+class ReadThroughCache:
+    """
+    In-process cache of decoded documents backed by files on disk.
+
+    Entries are dropped whenever the watched files change on disk (for
+    example when another process writes to them) or when this process
+    calls invalidate() after its own writes. At most max_entries are kept,
+    least recently used first out. Cached values are shared between
+    callers and must be treated as read-only.
+    """
+
+    def __init__(self, watched_paths: Callable[[], List[str]], max_entries: int = 4096):
+        self._watched_paths = watched_paths
+        self._lock = threading.Lock()
+        # Values are stored wrapped in a 1-tuple so a cached None is a hit
+        self._entries = LRUCache(max_entries)
+        self._signature: Optional[Tuple] = None
+        self._generation = 0
+        self.invalidations = 0
+
+    def _clear(self) -> None:
+        if len(self._entries):
+            self.invalidations += 1
+        self._entries.clear()
+        self._generation += 1
+
+    def _check_signature(self) -> Tuple:
+        signature = file_signature(self._watched_paths())
+        if signature != self._signature:
+            self._clear()
+            self._signature = signature
+        return signature
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for key, loading it on a miss.
+
+        Args:
+            key: Cache key
+            loader: Called with no arguments to produce the value on a miss
+
+        Returns:
+            The cached or freshly loaded value
+        """
+        with self._lock:
+            self._check_signature()
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            # Only keep the value if nothing was written while it loaded
+            self._check_signature()
+            if generation == self._generation:
+                self._entries.put(key, (value,))
+        return value
+
+    def invalidate(self) -> None:
+        """
+        Drop every entry, e.g. after this process has written to the files.
+        """
+        with self._lock:
+            self._clear()
+            self._signature = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report hit/miss counters for monitoring.
+        """
+        with self._lock:
+            stats = self._entries.stats()
+            del stats['expirations']
+            stats['invalidations'] = self.invalidations
+            return stats
+
+
+class LRUCache:
+    """
+    Bounded in-memory cache with least-recently-used eviction and an
+    optional time-to-live per entry.
+    """
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the value stored under key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entries beyond max_entries.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report hit/miss counters for monitoring.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
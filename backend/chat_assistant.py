@@ -1,13 +1,156 @@
+import hashlib
 import json
-from typing import Dict, Any, List, Union
-from openai import OpenAI
+import os
+import re
+import time
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+from cache import LRUCache
+from chat_context import ReceiptIndex, estimate_tokens
+from openai_client import chat_completion
+
+NO_RECEIPTS_MESSAGE = "You don't have any receipts in the system yet. Upload some receipts to ask questions about them."
+
+ERROR_PREFIX = "Sorry, I encountered an error"
+
+CHAT_MODEL = "gpt-4o-mini"
+
+# Answers to repeated questions over unchanged data
+response_cache = LRUCache(
+    max_entries=int(os.getenv('EERIS_CHAT_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('EERIS_CHAT_CACHE_TTL', '3600'))
+)
+
+
+def _strip_user_prefix(content: str) -> str:
+    return re.sub(r'^\[User: [^\]]*\]\s*', '', content)
+
+
+def _normalize_message(message: str) -> str:
+    return ' '.join(message.lower().split()).rstrip('?!. ')
+
+
+def response_cache_key(
+    data_version: str,
+    message: str,
+    conversation_history: List[Dict[str, str]] = None,
+    current_user: str = None
+) -> Tuple[str, str, str, str]:
+    """
+    Cache key for a chat answer.
+    
+    Args:
+        data_version: storage.receipts_version of the asker's visible receipts,
+            so any change to them misses the cache
+        message: The user's query/message
+        conversation_history: Previous messages; the current message, which
+            the frontend also appends to the history, is left out
+        current_user: The asker, since "I" and "my" depend on who asks
+        
+    Returns:
+        Hashable key for response_cache
+    """
+    history = [
+        (msg.get("role"), _strip_user_prefix(msg.get("content", "")) if msg.get("role") == "user" else msg.get("content", ""))
+        for msg in (conversation_history or [])
+    ]
+    if history and history[-1] == ("user", message):
+        history.pop()
+    history_hash = hashlib.sha256(json.dumps(history).encode()).hexdigest()
+    return data_version, _normalize_message(message), history_hash, current_user or ''
+
+
+def build_chat_messages(
+    message: str,
+    user_data: List[Dict[str, Any]],
+    conversation_history: List[Dict[str, str]] = None,
+    current_user: str = None,
+    index: Optional[ReceiptIndex] = None
+) -> List[Dict[str, str]]:
+    """
+    Build the OpenAI messages for a chat request, receipt context included.
+    
+    The result only holds the compact context text, so the caller can drop
+    the receipts as soon as this returns.
+    
+    Args:
+        message: The user's query/message
+        user_data: List of receipt data for the user
+        conversation_history: List of previous messages in the conversation
+        current_user: The username of the currently logged-in user
+        index: Prebuilt ReceiptIndex over user_data, to avoid rebuilding it
+        
+    Returns:
+        List of chat messages ready for chat_completion
+    """
+    if index is None:
+        index = ReceiptIndex(user_data)
+    known_users = index.users
+    
+    # Send totals plus the receipts most relevant to the question, not
+    # the whole history; a follow-up also searches with the question before it
+    questions = [
+        _strip_user_prefix(msg["content"])
+        for msg in (conversation_history or []) if msg.get("role") == "user"
+    ]
+    previous_questions = [question for question in questions if question != message]
+    query = ' '.join(previous_questions[-1:] + [message])
+    context = index.build_context(query)
+    
+    # Prepare messages for the API call
+    messages = [
+        {
+            "role": "system", 
+            "content": (
+                "You are a helpful assistant that answers questions about receipt data. "
+                "Keep your responses concise but friendly. Avoid unnecessary details. "
+                f"The current user asking questions is: {current_user}. If they use 'I' or 'me' in their questions, they are referring to themselves. "
+                "If asked about a person who doesn't exist in the data, respond 'I don't know who that is' and list the users you do have information about. "
+                f"The known users in the system are: {', '.join(known_users) if known_users else 'none'}. "
+                "When a supervisor asks about 'my team' or 'team members', they are referring to the users whose receipts they can see. "
+                "Help analyze expenses, spending patterns, and provide insights when asked. "
+                "You can reference previous parts of the conversation if relevant."
+            )
+        }
+    ]
+    
+    # Add data context as a separate system message
+    messages.append({
+        "role": "system",
+        "content": f"Receipt data context:\n{context}"
+    })
+    
+    # Add conversation history if provided
+    if conversation_history and len(conversation_history) > 0:
+        # Process each message in the history
+        for msg in conversation_history:
+            if msg["role"] == "user":
+                # Extract the actual message content (remove the [User: username] prefix)
+                content = msg["content"]
+                if content.startswith(f"[User: {current_user}]"):
+                    content = content[len(f"[User: {current_user}]"):].strip()
+                messages.append({
+                    "role": "user",
+                    "content": content
+                })
+            else:
+                messages.append(msg)
+    else:
+        # If no history, just add the current message
+        messages.append({
+            "role": "user",
+            "content": message
+        })
+    return messages
+
 
 def process_chat_request(
     message: str, 
     user_data: List[Dict[str, Any]], 
     api_key: str,
     conversation_history: List[Dict[str, str]] = None,
-    current_user: str = None
+    current_user: str = None,
+    index: Optional[ReceiptIndex] = None
 ) -> str:
     """
     Process a chat request and generate a response based on user's receipt data.
@@ -18,6 +161,7 @@ def process_chat_request(
         api_key: OpenAI API key
         conversation_history: List of previous messages in the conversation
         current_user: The username of the currently logged-in user
+        index: Prebuilt ReceiptIndex over user_data, to avoid rebuilding it
         
     Returns:
         The assistant's response to the user's question
@@ -25,68 +169,14 @@ def process_chat_request(
     try:
         # If no receipts, return a simple message
         if not user_data:
-            return "You don't have any receipts in the system yet. Upload some receipts to ask questions about them."
-        
-        # Extract the list of usernames present in the data
-        known_users = set()
-        for receipt in user_data:
-            if 'username' in receipt:
-                known_users.add(receipt['username'])
-        
-        # Prepare context for OpenAI
-        context = json.dumps(user_data, indent=2)
-        
-        # Set up OpenAI client
-        client = OpenAI(api_key=api_key)
+            return NO_RECEIPTS_MESSAGE
         
-        # Prepare messages for the API call
-        messages = [
-            {
-                "role": "system", 
-                "content": (
-                    "You are a helpful assistant that answers questions about receipt data. "
-                    "Keep your responses concise but friendly. Avoid unnecessary details. "
-                    f"The current user asking questions is: {current_user}. If they use 'I' or 'me' in their questions, they are referring to themselves. "
-                    "If asked about a person who doesn't exist in the data, respond 'I don't know who that is' and list the users you do have information about. "
-                    f"The known users in the system are: {', '.join(known_users) if known_users else 'none'}. "
-                    "When a supervisor asks about 'my team' or 'team members', they are referring to the users whose receipts they can see. "
-                    "Help analyze expenses, spending patterns, and provide insights when asked. "
-                    "You can reference previous parts of the conversation if relevant."
-                )
-            }
-        ]
-        
-        # Add data context as a separate system message
-        messages.append({
-            "role": "system",
-            "content": f"Receipt data context (JSON):\n{context}"
-        })
-        
-        # Add conversation history if provided
-        if conversation_history and len(conversation_history) > 0:
-            # Process each message in the history
-            for msg in conversation_history:
-                if msg["role"] == "user":
-                    # Extract the actual message content (remove the [User: username] prefix)
-                    content = msg["content"]
-                    if content.startswith(f"[User: {current_user}]"):
-                        content = content[len(f"[User: {current_user}]"):].strip()
-                    messages.append({
-                        "role": "user",
-                        "content": content
-                    })
-                else:
-                    messages.append(msg)
-        else:
-            # If no history, just add the current message
-            messages.append({
-                "role": "user",
-                "content": message
-            })
+        messages = build_chat_messages(message, user_data, conversation_history, current_user, index)
         
         # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        response = chat_completion(
+            api_key,
+            model=CHAT_MODEL,
             messages=messages
         )
         
@@ -94,4 +184,64 @@ def process_chat_request(
         return response.choices[0].message.content
         
     except Exception as e:
-        return f"Sorry, I encountered an error: {str(e)}" 
\ No newline at end of file
+        return f"{ERROR_PREFIX}: {str(e)}"
+
+
+def stream_chat_response(
+    messages: List[Dict[str, str]],
+    api_key: str
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Stream a chat completion as it is generated.
+    
+    Args:
+        messages: Output of build_chat_messages
+        api_key: OpenAI API key
+        
+    Yields:
+        ('token', {'text': ...}) for each piece of the answer, then one
+        ('done', {'usage': ..., 'timing': ...}) event. Usage comes from the
+        API when it reports it and is estimated from text length otherwise.
+    """
+    start = time.perf_counter()
+    first_token_ms = None
+    usage = None
+    parts = []
+    
+    stream = chat_completion(
+        api_key,
+        model=CHAT_MODEL,
+        messages=messages,
+        stream=True,
+        # Ask for a final chunk carrying token usage (ignored by servers without it)
+        extra_body={"stream_options": {"include_usage": True}}
+    )
+    for chunk in stream:
+        chunk_usage = getattr(chunk, 'usage', None)
+        if chunk_usage:
+            usage = chunk_usage if isinstance(chunk_usage, dict) else chunk_usage.model_dump()
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content
+        if text:
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - start) * 1000, 1)
+            parts.append(text)
+            yield 'token', {'text': text}
+    
+    if usage is None:
+        prompt_tokens = sum(estimate_tokens(msg["content"]) for msg in messages)
+        completion_tokens = estimate_tokens(''.join(parts))
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'estimated': True
+        }
+    yield 'done', {
+        'usage': usage,
+        'timing': {
+            'first_token_ms': first_token_ms,
+            'total_ms': round((time.perf_counter() - start) * 1000, 1)
+        }
+    }
@@ -0,0 +1,201 @@
+import math
+import os
+import re
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from amounts import receipt_cents, receipt_month
+
+# Rough budget, in tokens, for the receipt data sent with each chat request
+CONTEXT_TOKEN_BUDGET = int(os.getenv('EERIS_CHAT_CONTEXT_TOKENS', '3000'))
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'at', 'did', 'do', 'for', 'from', 'how', 'i', 'in', 'is',
+    'it', 'me', 'much', 'my', 'of', 'on', 'spend', 'spent', 'the', 'to', 'was', 'what',
+    'when', 'where', 'which', 'who', 'with'
+}
+
+ROW_HEADER = 'date | user | store | total | category | status | items'
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    # About four characters per token for English text and numbers
+    return len(text) // 4 + 1
+
+
+def _month(receipt: Dict[str, Any]) -> str:
+    return receipt_month(receipt.get('date')) or 'unknown'
+
+
+def _document_text(receipt: Dict[str, Any]) -> str:
+    words = [
+        receipt.get('store_name') or '',
+        ' '.join(receipt.get('line_items') or []),
+        receipt.get('expense_category') or '',
+        receipt.get('date') or '',
+        receipt.get('username') or '',
+        receipt.get('payment_method') or '',
+        receipt.get('status') or '',
+    ]
+    # Month names, so "March" or "mar" finds receipts dated 2025-03-..
+    try:
+        date = datetime.strptime(receipt.get('date') or '', '%Y-%m-%d')
+        words += [date.strftime('%B'), date.strftime('%b')]
+    except ValueError:
+        pass
+    return ' '.join(words)
+
+
+def compact_row(receipt: Dict[str, Any], max_items: int = 5) -> str:
+    """
+    One line summary of a receipt, far smaller than its JSON.
+    """
+    items = receipt.get('line_items') or []
+    item_text = '; '.join(items[:max_items])
+    if len(items) > max_items:
+        item_text += f'; +{len(items) - max_items} more'
+    return ' | '.join([
+        receipt.get('date') or '?',
+        receipt.get('username') or '?',
+        receipt.get('store_name') or '?',
+        receipt.get('total_payment') or '?',
+        receipt.get('expense_category') or '-',
+        receipt.get('status') or 'pending',
+        item_text or '-',
+    ])
+
+
+def compute_aggregates(receipts: List[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """
+    Count and total (in cents) the receipts per user, category and month.
+
+    Returns:
+        {'user': {...}, 'category': {...}, 'month': {...}}, each mapping a
+        key to {'count': n, 'cents': total}
+    """
+    aggregates = {'user': {}, 'category': {}, 'month': {}}
+    for receipt in receipts:
+        cents = receipt_cents(receipt)
+        keys = {
+            'user': receipt.get('username') or 'unknown',
+            'category': receipt.get('expense_category') or 'uncategorized',
+            'month': _month(receipt),
+        }
+        for group, key in keys.items():
+            bucket = aggregates[group].setdefault(key, {'count': 0, 'cents': 0})
+            bucket['count'] += 1
+            bucket['cents'] += cents
+    return aggregates
+
+
+def format_aggregates(aggregates: Dict[str, Dict[str, Dict[str, int]]]) -> str:
+    lines = []
+    for group in ('user', 'category', 'month'):
+        parts = [
+            f"{key}: {bucket['count']} receipts, ${bucket['cents'] / 100:.2f}"
+            for key, bucket in sorted(aggregates[group].items())
+        ]
+        lines.append(f"Totals by {group}: " + ('; '.join(parts) or 'none'))
+    return '\n'.join(lines)
+
+
+class ReceiptIndex:
+    """
+    BM25 index over a user's visible receipts, with precomputed totals.
+
+    Build it once per version of the data (see storage.cached) and query
+    it for every chat message; it is read-only after construction. Only the
+    compact rows are kept, not the receipts themselves, so a cached index
+    does not pin the decoded receipt list in memory.
+    """
+
+    def __init__(self, receipts: List[Dict[str, Any]]):
+        self.count = len(receipts)
+        self.rows = [compact_row(receipt) for receipt in receipts]
+        self.aggregates = compute_aggregates(receipts)
+        self.users = sorted({receipt['username'] for receipt in receipts if receipt.get('username')})
+
+        # Most recent first, used to fill leftover budget
+        self.recent = sorted(range(len(receipts)),
+                             key=lambda doc: receipts[doc].get('date') or '', reverse=True)
+
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._lengths = []
+        for doc, receipt in enumerate(receipts):
+            terms = tokenize(_document_text(receipt))
+            self._lengths.append(len(terms))
+            for term in terms:
+                self._postings[term][doc] = self._postings[term].get(doc, 0) + 1
+        self._average_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Rank receipts against a query.
+
+        Args:
+            query: Free text, e.g. the user's chat message
+            limit: Maximum number of results (default all matches)
+
+        Returns:
+            (receipt position, score) pairs, best first; receipts sharing no
+            term with the query are left out
+        """
+        total = self.count
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, frequency in postings.items():
+                length_norm = 1 - BM25_B + BM25_B * self._lengths[doc] / self._average_length
+                scores[doc] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        ranked = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+        return ranked[:limit] if limit else ranked
+
+    def build_context(self, query: str, token_budget: Optional[int] = None) -> str:
+        """
+        Assemble the receipt context for one chat message within a token budget.
+
+        The totals always go in. The rest of the budget is filled with compact
+        rows, the best matches for the query first and then the most recent
+        receipts, so small histories are still sent in full.
+
+        Args:
+            query: Text to rank receipts against
+            token_budget: Approximate token limit (default EERIS_CHAT_CONTEXT_TOKENS)
+
+        Returns:
+            Plain text context for the system message
+        """
+        budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+        summary = format_aggregates(self.aggregates)
+        budget -= estimate_tokens(summary) + estimate_tokens(ROW_HEADER)
+
+        chosen = []
+        seen = set()
+        for doc in [doc for doc, _ in self.search(query)] + self.recent:
+            if doc in seen:
+                continue
+            seen.add(doc)
+            cost = estimate_tokens(self.rows[doc])
+            if cost > budget:
+                break
+            budget -= cost
+            chosen.append(doc)
+
+        shown = f"Receipts ({len(chosen)} of {self.count} shown, most relevant first):"
+        return '\n'.join([summary, '', shown, ROW_HEADER] + [self.rows[doc] for doc in chosen])
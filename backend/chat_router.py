@@ -0,0 +1,301 @@
+import calendar
+import re
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional, Iterable
+
+from amounts import receipt_cents
+
+# Questions asking for judgement rather than numbers always go to the LLM
+OPEN_ENDED_RE = re.compile(
+    r'\b(why|should|suggest\w*|recommend\w*|advice|advise|compare|comparison|trends?|'
+    r'patterns?|insights?|explain|summar\w+|reduce|save|saving|unusual|tips?|analy\w+)\b'
+)
+
+METRIC_PATTERNS = [
+    ('count', re.compile(r'\bhow many\b|\bnumber of\b|\bcount\b')),
+    ('average', re.compile(r'\baverage\b|\bmean\b')),
+    ('max', re.compile(r'\b(biggest|largest|most expensive|highest|priciest)\b')),
+    ('sum', re.compile(r'\bhow much\b|\btotal\b|\bspen[dt]\b|\bsum\b|\bcost\b')),
+]
+
+GROUP_RE = re.compile(r'\b(?:by|per|each|breakdown (?:by|of))\s+(category|categories|month|user|person|employee|member)\b')
+GROUP_NAMES = {'category': 'category', 'categories': 'category', 'month': 'month',
+               'user': 'user', 'person': 'user', 'employee': 'user', 'member': 'user'}
+
+CATEGORY_WORDS = {
+    'meals': ('meal', 'meals', 'food', 'lunch', 'lunches', 'dinner', 'dinners', 'breakfast',
+              'restaurant', 'restaurants', 'dining', 'coffee'),
+    'travel': ('travel', 'trip', 'trips', 'flight', 'flights', 'hotel', 'hotels', 'airfare'),
+    'office supplies': ('office', 'supplies', 'stationery'),
+    'entertainment': ('entertainment', 'movie', 'movies', 'event', 'events', 'tickets'),
+    'training': ('training', 'course', 'courses', 'conference', 'conferences', 'seminar'),
+    'transportation': ('transportation', 'taxi', 'uber', 'lyft', 'gas', 'fuel', 'parking',
+                       'transit', 'rideshare'),
+}
+
+STATUS_WORDS = {
+    'approved': ('approved',),
+    'pending': ('pending', 'submitted', 'awaiting', 'unapproved'),
+    'denied': ('denied', 'rejected', 'declined'),
+}
+STATUS_VALUES = {
+    'approved': {'approved'},
+    'pending': {'pending', 'submitted', ''},
+    'denied': {'denied', 'rejected'},
+}
+
+MONTH_RE = re.compile(
+    r'\b(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|'
+    r'sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b(?:\s+(\d{4}))?'
+)
+STORE_HINT_RE = re.compile(r"\b(?:at|from)\s+(?!the\b)([a-z0-9&']+)")
+QUARTER_RE = re.compile(r'\bq([1-4])\b(?:\s+(\d{4}))?')
+YEAR_RE = re.compile(r'\b(20\d{2})\b')
+
+
+def _month_range(year: int, month: int):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _quarter_range(year: int, quarter: int):
+    start, _ = _month_range(year, 3 * quarter - 2)
+    _, end = _month_range(year, 3 * quarter)
+    return start, end
+
+
+def _parse_period(text: str, today: date):
+    # Returns (start, end, label) or None when the question names no period
+    if 'today' in text:
+        return today, today, 'today'
+    if 'this week' in text or 'last week' in text:
+        start = today - timedelta(days=today.weekday())
+        if 'last week' in text:
+            start -= timedelta(days=7)
+            return start, start + timedelta(days=6), 'last week'
+        return start, today, 'this week'
+    if 'this month' in text:
+        return date(today.year, today.month, 1), today, 'this month'
+    if 'last month' in text:
+        end = date(today.year, today.month, 1) - timedelta(days=1)
+        return date(end.year, end.month, 1), end, 'last month'
+    current_quarter = (today.month - 1) // 3 + 1
+    if 'this quarter' in text:
+        return _quarter_range(today.year, current_quarter)[0], today, 'this quarter'
+    if 'last quarter' in text:
+        year, quarter = (today.year, current_quarter - 1) if current_quarter > 1 else (today.year - 1, 4)
+        return _quarter_range(year, quarter) + (f'Q{quarter} {year}',)
+    if 'this year' in text:
+        return date(today.year, 1, 1), today, str(today.year)
+    if 'last year' in text:
+        return date(today.year - 1, 1, 1), date(today.year - 1, 12, 31), str(today.year - 1)
+
+    match = QUARTER_RE.search(text)
+    if match:
+        quarter = int(match.group(1))
+        year = int(match.group(2)) if match.group(2) else today.year
+        return _quarter_range(year, quarter) + (f'Q{quarter} {year}',)
+
+    match = MONTH_RE.search(text)
+    if match:
+        month = [name.lower() for name in calendar.month_abbr].index(match.group(1)[:3])
+        if match.group(2):
+            year = int(match.group(2))
+        else:
+            # A bare month name means its most recent occurrence
+            year = today.year if month <= today.month else today.year - 1
+        return _month_range(year, month) + (f'{calendar.month_name[month]} {year}',)
+
+    match = YEAR_RE.search(text)
+    if match:
+        year = int(match.group(1))
+        return date(year, 1, 1), date(year, 12, 31), str(year)
+    return None
+
+
+def parse_question(
+    message: str,
+    current_user: str,
+    visible_users: Iterable[str],
+    all_users: Iterable[str] = (),
+    today: Optional[date] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Recognize an aggregation question and turn it into a structured query.
+
+    Args:
+        message: The user's chat message
+        current_user: Username of the person asking
+        visible_users: Owners of the receipts the asker may see
+        all_users: Every username in the system, to spot questions about
+            people the asker may not see
+        today: Reference date for relative periods (default today)
+
+    Returns:
+        Query dictionary with 'metric', 'group_by', 'users', 'categories',
+        'statuses', 'period' and 'store', or None if the question should go
+        to the LLM
+    """
+    text = ' '.join(message.lower().split())
+    if OPEN_ENDED_RE.search(text):
+        return None
+    group = GROUP_RE.search(text)
+    metric = next((name for name, pattern in METRIC_PATTERNS if pattern.search(text)), None)
+    if metric is None and group:
+        metric = 'sum'
+    if metric is None:
+        return None
+
+    words = set(re.findall(r"[a-z0-9']+", text))
+    visible = {user.lower(): user for user in visible_users}
+    mentioned = {word for word in words if word in {user.lower() for user in all_users}}
+    # Someone the asker cannot see: let the LLM explain who it knows about
+    if mentioned - set(visible):
+        return None
+
+    if mentioned:
+        users = sorted(visible[word] for word in mentioned)
+    elif words & {'i', 'me', 'my', "i've", 'mine'} and not words & {'team', 'everyone', 'we', 'our'}:
+        users = [current_user]
+    else:
+        users = None
+
+    categories = [category for category, aliases in CATEGORY_WORDS.items() if words & set(aliases)]
+    statuses = [status for status, aliases in STATUS_WORDS.items() if words & set(aliases)]
+
+    return {
+        'metric': metric,
+        'group_by': GROUP_NAMES[group.group(1)] if group else None,
+        'users': users,
+        'categories': categories,
+        'statuses': statuses,
+        'period': _parse_period(text, today or date.today()),
+        'store': None,
+    }
+
+
+def _matches(receipt: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    if query['users'] is not None and receipt.get('username') not in query['users']:
+        return False
+    if query['categories'] and receipt.get('expense_category') not in query['categories']:
+        return False
+    if query['statuses']:
+        allowed = set().union(*(STATUS_VALUES[status] for status in query['statuses']))
+        if (receipt.get('status') or '') not in allowed:
+            return False
+    if query['store'] and query['store'] not in (receipt.get('store_name') or '').lower():
+        return False
+    if query['period']:
+        start, end, _ = query['period']
+        receipt_date = receipt.get('date') or ''
+        if not (start.isoformat() <= receipt_date <= end.isoformat()):
+            return False
+    return True
+
+
+def _group_key(receipt: Dict[str, Any], group_by: str) -> str:
+    if group_by == 'category':
+        return receipt.get('expense_category') or 'uncategorized'
+    if group_by == 'month':
+        return (receipt.get('date') or '')[:7] or 'unknown'
+    return receipt.get('username') or 'unknown'
+
+
+def _describe(query: Dict[str, Any], current_user: str) -> str:
+    parts = []
+    if query['users'] == [current_user]:
+        parts.append('your receipts')
+    elif query['users']:
+        parts.append(', '.join(query['users']))
+    parts += query['categories'] + query['statuses']
+    if query['period']:
+        parts.append(query['period'][2])
+    return f" ({', '.join(parts)})" if parts else ''
+
+
+def _money(cents: int) -> str:
+    return f'${cents / 100:,.2f}'
+
+
+def run_query(query: Dict[str, Any], receipts: List[Dict[str, Any]], current_user: str) -> str:
+    """
+    Evaluate a parsed query over receipts and phrase the answer.
+
+    Args:
+        query: Output of parse_question
+        receipts: Receipts the asker may see
+        current_user: Username of the person asking
+
+    Returns:
+        A short natural-language answer
+    """
+    matched = [receipt for receipt in receipts if _matches(receipt, query)]
+    scope = _describe(query, current_user)
+    if not matched:
+        return f"I couldn't find any receipts{scope}."
+
+    cents = [receipt_cents(receipt) for receipt in matched]
+    plural = 's' if len(matched) != 1 else ''
+
+    if query['group_by']:
+        groups: Dict[str, List[int]] = {}
+        for receipt, amount in zip(matched, cents):
+            groups.setdefault(_group_key(receipt, query['group_by']), []).append(amount)
+        lines = [f"Spending by {query['group_by']}{scope}:"]
+        for key, amounts in sorted(groups.items(), key=lambda item: -sum(item[1])):
+            lines.append(f"- {key}: {_money(sum(amounts))} ({len(amounts)} receipt{'s' if len(amounts) != 1 else ''})")
+        return '\n'.join(lines)
+
+    if query['metric'] == 'count':
+        return f"{len(matched)} receipt{plural}{scope}, totalling {_money(sum(cents))}."
+    if query['metric'] == 'average':
+        return f"Average of {_money(sum(cents) // len(matched))} over {len(matched)} receipt{plural}{scope}."
+    if query['metric'] == 'max':
+        amount, receipt = max(zip(cents, matched), key=lambda pair: pair[0])
+        return (f"The largest was {_money(amount)} at {receipt.get('store_name') or 'an unknown store'}"
+                f" on {receipt.get('date') or 'an unknown date'}{scope}.")
+    return f"Total of {_money(sum(cents))} across {len(matched)} receipt{plural}{scope}."
+
+
+def answer_locally(
+    message: str,
+    receipts: List[Dict[str, Any]],
+    current_user: str,
+    all_users: Iterable[str] = (),
+    today: Optional[date] = None
+) -> Optional[str]:
+    """
+    Answer common totals/count questions from the receipts without calling the LLM.
+
+    Args:
+        message: The user's chat message
+        receipts: Receipts the asker may see
+        current_user: Username of the person asking
+        all_users: Every username in the system
+        today: Reference date for relative periods (default today)
+
+    Returns:
+        The answer, or None if the question needs the LLM
+    """
+    visible_users = {receipt.get('username') for receipt in receipts if receipt.get('username')}
+    visible_users.add(current_user)
+    query = parse_question(message, current_user, visible_users, all_users, today)
+    if query is None:
+        return None
+
+    # Store names are matched against what is actually in the data, in full
+    # or by their first word ("walmart" for "Walmart Supercenter")
+    text = ' '.join(message.lower().split())
+    words = set(re.findall(r"[a-z0-9']+", text))
+    for store in sorted({(receipt.get('store_name') or '').lower() for receipt in receipts}, key=len, reverse=True):
+        first_word = store.split()[0] if store.split() else ''
+        if len(store) > 2 and store in text:
+            query['store'] = store
+            break
+        if len(first_word) > 3 and first_word in words and first_word not in CATEGORY_WORDS:
+            query['store'] = first_word
+            break
+    else:
+        # "at <somewhere>" that matches no store we know of: leave it to the LLM
+        if STORE_HINT_RE.search(text):
+            return None
+    return run_query(query, receipts, current_user)
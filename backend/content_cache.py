@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, BinaryIO, Dict, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    content_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (content_hash, kind)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries (last_used);
+"""
+
+CHUNK_SIZE = 64 * 1024
+
+
+def save_and_hash(stream: BinaryIO, path: str) -> str:
+    """
+    Copy an upload stream to disk, hashing it on the way.
+
+    Args:
+        stream: Readable binary stream (e.g. a werkzeug FileStorage's .stream)
+        path: Destination file
+
+    Returns:
+        Hex SHA-256 digest of the bytes written
+    """
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+class ContentCache:
+    """
+    Persistent, size-bounded LRU cache of values derived from file contents.
+
+    Values are stored per (content hash, kind), so the same upload can have
+    e.g. both its OCR text and its parsed fields cached. When the total
+    stored size exceeds max_bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, db_path: str, max_bytes: int):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db_path = db_path
+        self._max_bytes = max_bytes
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def get(self, kind: str, content_hash: str) -> Optional[Any]:
+        """
+        Fetch a cached value and mark it as recently used.
+
+        Args:
+            kind: Type of derived value, e.g. 'ocr_text'
+            content_hash: Hash of the source content
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT value FROM entries WHERE content_hash = ? AND kind = ?', (content_hash, kind)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        with conn:
+            conn.execute(
+                'UPDATE entries SET last_used = ? WHERE content_hash = ? AND kind = ?',
+                (time.time(), content_hash, kind)
+            )
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, kind: str, content_hash: str, value: Any) -> None:
+        """
+        Store a value, evicting least recently used entries if over budget.
+
+        Args:
+            kind: Type of derived value, e.g. 'ocr_text'
+            content_hash: Hash of the source content
+            value: JSON-serialisable value
+        """
+        encoded = json.dumps(value)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (content_hash, kind, value, size, last_used) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (content_hash, kind, encoded, len(encoded), time.time())
+            )
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total > self._max_bytes:
+                rows = conn.execute(
+                    'SELECT content_hash, kind, size FROM entries ORDER BY last_used'
+                ).fetchall()
+                for old_hash, old_kind, size in rows:
+                    if total <= self._max_bytes:
+                        break
+                    conn.execute(
+                        'DELETE FROM entries WHERE content_hash = ? AND kind = ?',
+                        (old_hash, old_kind)
+                    )
+                    total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report entry count, stored size and hit/miss counters.
+        """
+        entries, size = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+        ).fetchone()
+        return {
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self._max_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -1,15 +1,179 @@
 import pytesseract
-from PIL import Image
-from pdf2image import convert_from_path
-from typing import Union, List
+from PIL import Image, ImageOps
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PyPDF2 import PdfReader
+from typing import Union, List, Iterator, Optional, Tuple
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+import threading
 import os
 
-def extract_text_from_image(image_path: str) -> str:
+# PDF rasterisation settings, overridable per call
+PDF_DPI = int(os.getenv('EERIS_OCR_DPI', '200'))
+PDF_MAX_PAGES = int(os.getenv('EERIS_OCR_MAX_PAGES', '0'))  # 0 means no limit
+PDF_OCR_WORKERS = int(os.getenv('EERIS_OCR_WORKERS', str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv('EERIS_OCR_PAGES_PER_TASK', '1'))
+# Pages whose embedded text has fewer letters/digits than this are OCRed instead
+MIN_TEXT_LAYER_CHARS = int(os.getenv('EERIS_MIN_TEXT_LAYER_CHARS', '20'))
+
+# Image preprocessing ahead of Tesseract. Presets are combinations of the
+# keyword arguments of preprocess_image().
+PREPROCESS_PRESETS = {
+    'none': {},
+    'fast': {'max_megapixels': 6, 'grayscale': True},
+    'clean': {'max_megapixels': 12, 'grayscale': True, 'binarize': True},
+    'full': {'max_megapixels': 12, 'grayscale': True, 'binarize': True, 'deskew': True, 'crop': True},
+}
+# Uploads are OCRed as they are unless a preset is chosen; switch the default
+# only once benchmark_ocr.py shows the preset keeps text similarity at parity
+OCR_PREPROCESS = os.getenv('EERIS_OCR_PREPROCESS', 'none')
+# Tesseract page segmentation and engine modes, empty for Tesseract's defaults
+TESSERACT_PSM = os.getenv('EERIS_TESSERACT_PSM', '')
+TESSERACT_OEM = os.getenv('EERIS_TESSERACT_OEM', '')
+
+# Shared pool for page OCR, created on first use and never replaced, since
+# other requests may be submitting to it or waiting on its futures
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+def _get_page_pool(workers: int) -> ProcessPoolExecutor:
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(max_workers=max(workers, PDF_OCR_WORKERS))
+        return _page_pool
+
+def tesseract_config(psm: Optional[str] = None, oem: Optional[str] = None) -> str:
+    """
+    Build the Tesseract command-line options for the configured PSM/OEM.
+    """
+    psm = TESSERACT_PSM if psm is None else psm
+    oem = TESSERACT_OEM if oem is None else oem
+    options = []
+    if psm:
+        options.append(f"--psm {psm}")
+    if oem:
+        options.append(f"--oem {oem}")
+    return " ".join(options)
+
+def _otsu_threshold(image: Image.Image) -> int:
+    # Threshold that best separates the grayscale histogram into two classes
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background = weighted_background = 0
+    best_threshold, best_variance = 127, -1.0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+    return best_threshold
+
+def _estimate_skew(image: Image.Image, max_angle: int = 5) -> float:
+    # Text lines give the sharpest row-sum profile when they are horizontal,
+    # so pick the rotation with the highest profile variance
+    sample = image.copy()
+    sample.thumbnail((400, 400))
+    sample = ImageOps.invert(sample.convert('L'))
+    best_angle, best_score = 0.0, -1.0
+    for angle in range(-max_angle, max_angle + 1):
+        rotated = sample.rotate(angle, expand=False)
+        width, height = rotated.size
+        pixels = rotated.tobytes()
+        rows = [sum(pixels[y * width:(y + 1) * width]) for y in range(height)]
+        mean = sum(rows) / height
+        score = sum((row - mean) ** 2 for row in rows)
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def preprocess_image(
+    image: Image.Image,
+    max_megapixels: Optional[float] = None,
+    grayscale: bool = False,
+    binarize: bool = False,
+    threshold: Optional[int] = None,
+    deskew: bool = False,
+    crop: bool = False
+) -> Image.Image:
+    """
+    Prepare a photo or scan for OCR.
+    
+    OCR time grows with pixel count, so very large phone photos can be
+    scaled down first. The cap is on total pixels, whatever the orientation
+    or subject, so landscape photos and screenshots are not over-shrunk.
+    
+    Args:
+        image: Source image
+        max_megapixels: Downscale, keeping the aspect ratio, so the image has
+            at most this many million pixels; never upscales
+        grayscale: Convert to 8-bit grayscale
+        binarize: Threshold to pure black and white (implies grayscale)
+        threshold: Fixed threshold for binarize, default picks one per image
+        deskew: Straighten small rotations (up to 5 degrees)
+        crop: Trim uniform borders around the text
+        
+    Returns:
+        The processed image
+    """
+    if max_megapixels:
+        max_pixels = max_megapixels * 1_000_000
+        if image.format in ('JPEG', 'MPO'):
+            # Let the JPEG decoder skip detail we are about to throw away
+            scale = (max_pixels / (image.width * image.height)) ** 0.5
+            image.draft('RGB', (int(image.width * scale), int(image.height * scale)))
+    
+    image = ImageOps.exif_transpose(image)
+    
+    if max_megapixels:
+        scale = (max_pixels / (image.width * image.height)) ** 0.5
+        if scale < 1:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+    
+    if grayscale or binarize:
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency onto white before dropping colour
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.convert('RGBA').split()[-1])
+            image = background
+        image = image.convert('L')
+    
+    if deskew:
+        angle = _estimate_skew(image)
+        if angle:
+            image = image.rotate(angle, expand=True, fillcolor='white')
+    
+    if binarize:
+        cutoff = _otsu_threshold(image) if threshold is None else threshold
+        image = image.point(lambda value: 255 if value > cutoff else 0, mode='1').convert('L')
+    
+    if crop:
+        box = ImageOps.invert(image.convert('L')).getbbox()
+        if box:
+            margin = 10
+            image = image.crop((max(0, box[0] - margin), max(0, box[1] - margin),
+                                min(image.width, box[2] + margin), min(image.height, box[3] + margin)))
+    
+    return image
+
+def extract_text_from_image(image_path: str, preset: Optional[str] = None) -> str:
     """
     Extract text from an image file using OCR.
     
     Args:
         image_path: Path to the image file
+        preset: Name of a PREPROCESS_PRESETS entry (default EERIS_OCR_PREPROCESS)
         
     Returns:
         Extracted text as string
@@ -17,52 +181,211 @@ def extract_text_from_image(image_path: str) -> str:
     try:
         # Open the image
         image = Image.open(image_path)
+        image = preprocess_image(image, **PREPROCESS_PRESETS[preset or OCR_PREPROCESS])
         
         # Extract text using pytesseract
-        text = pytesseract.image_to_string(image)
+        text = pytesseract.image_to_string(image, config=tesseract_config())
         
         return text.strip()
     except Exception as e:
         raise Exception(f"Error extracting text from image: {str(e)}")
 
-def extract_text_from_pdf(pdf_path: str) -> str:
+def ocr_pdf_pages(pdf_path: str, first_page: int, last_page: int, dpi: int = PDF_DPI) -> List[str]:
     """
-    Convert PDF to images and extract text using OCR.
+    Rasterize a range of PDF pages and OCR them.
+    
+    Only the requested pages are rendered, so memory use is bounded by the
+    size of the range rather than the whole document.
     
     Args:
         pdf_path: Path to the PDF file
+        first_page: First page to process (1-based)
+        last_page: Last page to process (inclusive)
+        dpi: Rasterization resolution
         
     Returns:
-        Combined extracted text from all pages
+        Extracted text for each page in the range, in order
+    """
+    images = convert_from_path(
+        pdf_path,
+        dpi=dpi,
+        first_page=first_page,
+        last_page=last_page,
+        use_pdftocairo=True,
+        strict=False
+    )
+    return [pytesseract.image_to_string(image, config=tesseract_config()).strip() for image in images]
+
+def _page_ranges(pages: List[int], pages_per_task: int) -> List[Tuple[int, int]]:
+    # Group sorted page numbers into contiguous runs of at most pages_per_task
+    ranges = []
+    for page in pages:
+        if ranges and page == ranges[-1][1] + 1 and page - ranges[-1][0] < pages_per_task:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    return ranges
+
+def iter_pdf_page_text(
+    pdf_path: str,
+    dpi: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    workers: Optional[int] = None,
+    pages_per_task: Optional[int] = None,
+    pages: Optional[List[int]] = None
+) -> Iterator[str]:
+    """
+    Stream the OCR text of a PDF page by page.
+    
+    Pages are rendered lazily in small ranges. With more than one worker the
+    ranges are OCRed in parallel on a shared process pool; text is still yielded in
+    page order.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        dpi: Rasterization resolution (default EERIS_OCR_DPI)
+        max_pages: Stop after this many pages, 0 for all (default EERIS_OCR_MAX_PAGES)
+        workers: Page ranges to OCR in parallel (default EERIS_OCR_WORKERS)
+        pages_per_task: Pages rendered per task (default EERIS_OCR_PAGES_PER_TASK)
+        pages: Only OCR these 1-based page numbers (default every page)
+        
+    Yields:
+        Extracted text of each page
+    """
+    dpi = dpi or PDF_DPI
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    workers = workers or PDF_OCR_WORKERS
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+    
+    if pages is None:
+        page_count = pdfinfo_from_path(pdf_path)['Pages']
+        pages = range(1, page_count + 1)
+    pages = sorted(pages)
+    if max_pages:
+        pages = pages[:max_pages]
+    ranges = _page_ranges(pages, pages_per_task)
+    
+    if workers <= 1 or len(ranges) <= 1:
+        for first, last in ranges:
+            yield from ocr_pdf_pages(pdf_path, first, last, dpi)
+        return
+    
+    # The pool is shared, so workers only bounds this call's ranges in flight
+    pool = _get_page_pool(workers)
+    queued = iter(ranges)
+    futures = deque(pool.submit(ocr_pdf_pages, pdf_path, first, last, dpi)
+                    for first, last in islice(queued, workers))
+    while futures:
+        future = futures.popleft()
+        next_range = next(queued, None)
+        if next_range is not None:
+            futures.append(pool.submit(ocr_pdf_pages, pdf_path, *next_range, dpi))
+        yield from future.result()
+
+def extract_pdf_text_layer(pdf_path: str, max_pages: Optional[int] = None) -> List[str]:
+    """
+    Read the embedded text layer of a PDF without rasterizing it.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        max_pages: Stop after this many pages, 0 for all (default EERIS_OCR_MAX_PAGES)
+        
+    Returns:
+        Text of each page, empty for pages without a text layer
+    """
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    reader = PdfReader(pdf_path)
+    pages = reader.pages[:max_pages] if max_pages else reader.pages
+    return [(page.extract_text() or '').strip() for page in pages]
+
+def has_usable_text(text: str) -> bool:
+    """
+    Whether a page's embedded text is substantial enough to skip OCR.
+    """
+    return sum(c.isalnum() for c in text) >= MIN_TEXT_LAYER_CHARS
+
+def extract_pdf_text(
+    pdf_path: str,
+    dpi: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    workers: Optional[int] = None
+) -> Tuple[str, str]:
+    """
+    Extract text from a PDF, preferring its embedded text layer.
+    
+    Pages of digitally generated PDFs are read directly; only pages without
+    usable embedded text are rasterized and OCRed.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        dpi: Rasterization resolution (default EERIS_OCR_DPI)
+        max_pages: Stop after this many pages, 0 for all (default EERIS_OCR_MAX_PAGES)
+        workers: Page ranges to OCR in parallel (default EERIS_OCR_WORKERS)
+        
+    Returns:
+        Tuple of the combined text and the tier used: 'text_layer', 'ocr'
+        or 'mixed'
     """
     try:
-        # Convert PDF to images with minimal settings
-        images = convert_from_path(
-            pdf_path,
-            use_pdftocairo=True,
-            strict=False
-        )
+        try:
+            page_texts = extract_pdf_text_layer(pdf_path, max_pages)
+        except Exception:
+            # Unreadable or encrypted text layer, OCR everything
+            page_texts = None
         
-        # Extract text from each page
-        extracted_text = []
-        for image in images:
-            text = pytesseract.image_to_string(image)
-            extracted_text.append(text.strip())
+        if page_texts is None:
+            text = "\n\n".join(iter_pdf_page_text(pdf_path, dpi, max_pages, workers))
+            return text, 'ocr'
+        
+        missing = [number for number, text in enumerate(page_texts, start=1)
+                   if not has_usable_text(text)]
+        if missing:
+            ocr_texts = iter_pdf_page_text(pdf_path, dpi, max_pages, workers, pages=missing)
+            for number, text in zip(missing, ocr_texts):
+                page_texts[number - 1] = text
+        
+        if not missing:
+            source = 'text_layer'
+        elif len(missing) == len(page_texts):
+            source = 'ocr'
+        else:
+            source = 'mixed'
         
         # Combine text from all pages
-        return "\n\n".join(extracted_text)
+        return "\n\n".join(page_texts), source
     except Exception as e:
         raise Exception(f"Error extracting text from PDF: {str(e)}")
 
-def extract_text_from_file(file_path: str) -> str:
+def extract_text_from_pdf(
+    pdf_path: str,
+    dpi: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    workers: Optional[int] = None
+) -> str:
     """
-    Extract text from either an image or PDF file.
+    Extract text from a PDF, using OCR only for pages without a text layer.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        dpi: Rasterization resolution (default EERIS_OCR_DPI)
+        max_pages: Stop after this many pages, 0 for all (default EERIS_OCR_MAX_PAGES)
+        workers: Page ranges to OCR in parallel (default EERIS_OCR_WORKERS)
+        
+    Returns:
+        Combined extracted text from all pages
+    """
+    return extract_pdf_text(pdf_path, dpi, max_pages, workers)[0]
+
+def extract_text_with_source(file_path: str) -> Tuple[str, str]:
+    """
+    Extract text from either an image or PDF file, reporting how it was obtained.
     
     Args:
         file_path: Path to the file (image or PDF)
         
     Returns:
-        Extracted text as string
+        Tuple of the extracted text and the tier used: 'text_layer', 'ocr'
+        or 'mixed'
     """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
@@ -72,8 +395,20 @@ def extract_text_from_file(file_path: str) -> str:
     
     # Handle based on file type
     if ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
-        return extract_text_from_image(file_path)
+        return extract_text_from_image(file_path), 'ocr'
     elif ext == '.pdf':
-        return extract_text_from_pdf(file_path)
+        return extract_pdf_text(file_path)
     else:
-        raise ValueError(f"Unsupported file type: {ext}") 
\ No newline at end of file
+        raise ValueError(f"Unsupported file type: {ext}")
+
+def extract_text_from_file(file_path: str) -> str:
+    """
+    Extract text from either an image or PDF file.
+    
+    Args:
+        file_path: Path to the file (image or PDF)
+        
+    Returns:
+        Extracted text as string
+    """
+    return extract_text_with_source(file_path)[0] 
\ No newline at end of file
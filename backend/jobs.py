@@ -0,0 +1,254 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# A stage receives the job payload and the previous stage's output
+Stage = Tuple[str, Callable[[Dict[str, Any], Any], Any]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    username TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    completed_stages INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    output TEXT,
+    error TEXT,
+    worker TEXT,
+    lease_expires REAL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+"""
+
+FINISHED = ('done', 'failed')
+
+# A worker renews the lease on its unfinished jobs every third of this
+# period; another process only takes over a job once its lease has expired
+LEASE_SECONDS = float(os.getenv('EERIS_JOB_LEASE_SECONDS', '30'))
+
+
+class JobQueue:
+    """
+    Background job runner with results persisted to SQLite.
+
+    Each job kind is a list of named stages. Stages run one at a time on a
+    thread or process pool; progress and each stage's output are written
+    to the jobs database between stages, so a job interrupted by a restart
+    resumes from its last completed stage.
+
+    Every unfinished job is leased by the process running it. A background
+    thread renews this process's leases and takes over jobs whose lease has
+    run out, i.e. whose process has stopped.
+    """
+
+    def __init__(self, db_path: str, workers: int = 2, use_processes: bool = False):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db_path = db_path
+        self._local = threading.local()
+        self._workers = workers
+        self._use_processes = use_processes
+        self._executor: Optional[Executor] = None
+        self._executor_lock = threading.Lock()
+        self._kinds: Dict[str, List[Stage]] = {}
+        self._worker_id = uuid.uuid4().hex
+        self._heartbeat: Optional[threading.Thread] = None
+
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.executescript(SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            if 'lease_expires' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN lease_expires REAL')
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _pool(self) -> Executor:
+        with self._executor_lock:
+            if self._executor is None:
+                if self._use_processes:
+                    self._executor = ProcessPoolExecutor(max_workers=self._workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._workers, thread_name_prefix='eeris-job'
+                    )
+            return self._executor
+
+    def register(self, kind: str, stages: List[Stage]) -> None:
+        """
+        Declare a job kind.
+
+        Args:
+            kind: Name used when submitting jobs
+            stages: Ordered (name, function) pairs; functions must be picklable
+                when the queue runs on a process pool
+        """
+        self._kinds[kind] = stages
+
+    def submit(self, kind: str, username: str, payload: Dict[str, Any]) -> str:
+        """
+        Queue a new job and return its id immediately.
+
+        Args:
+            kind: A registered job kind
+            username: User the job belongs to
+            payload: JSON-serialisable job input
+
+        Returns:
+            The new job id
+        """
+        if kind not in self._kinds:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, username, status, payload, worker, lease_expires, '
+                "created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, kind, username, json.dumps(payload), self._worker_id,
+                 time.time() + LEASE_SECONDS, now, now)
+            )
+        self._run_stage(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a job's status, progress and (once finished) result.
+
+        Returns:
+            Job dictionary, or None if no such job exists
+        """
+        row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        stages = self._kinds.get(row['kind'], [])
+        job = {
+            'id': row['id'],
+            'kind': row['kind'],
+            'username': row['username'],
+            'status': row['status'],
+            'stage': row['stage'],
+            'progress': {
+                'completed_stages': row['completed_stages'],
+                'total_stages': len(stages)
+            },
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+        if row['status'] == 'done':
+            job['result'] = json.loads(row['output'])
+        return job
+
+    def recover(self) -> int:
+        """
+        Take over unfinished jobs whose lease has expired.
+
+        Each job is claimed with a compare-and-set on its worker and lease,
+        so when several processes try together only one resumes it. Also
+        starts the thread that renews this process's leases and calls
+        recover() again every renewal.
+
+        Returns:
+            Number of jobs resumed by this process
+        """
+        self._start_heartbeat()
+        conn = self._connection()
+        now = time.time()
+        rows = conn.execute(
+            "SELECT id, worker FROM jobs WHERE status IN ('queued', 'running') "
+            'AND worker != ? AND IFNULL(lease_expires, 0) < ?',
+            (self._worker_id, now)
+        ).fetchall()
+
+        resumed = 0
+        for row in rows:
+            with conn:
+                claimed = conn.execute(
+                    'UPDATE jobs SET worker = ?, lease_expires = ? '
+                    'WHERE id = ? AND worker = ? AND IFNULL(lease_expires, 0) < ?',
+                    (self._worker_id, now + LEASE_SECONDS, row['id'], row['worker'], now)
+                ).rowcount
+            if claimed:
+                self._run_stage(row['id'])
+                resumed += 1
+        return resumed
+
+    def _start_heartbeat(self) -> None:
+        with self._executor_lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(
+                    target=self._renew_leases, name='eeris-job-lease', daemon=True
+                )
+                self._heartbeat.start()
+
+    def _renew_leases(self) -> None:
+        while True:
+            time.sleep(LEASE_SECONDS / 3)
+            try:
+                with self._connection() as conn:
+                    conn.execute(
+                        "UPDATE jobs SET lease_expires = ? WHERE worker = ? "
+                        "AND status IN ('queued', 'running')",
+                        (time.time() + LEASE_SECONDS, self._worker_id)
+                    )
+                self.recover()
+            except sqlite3.Error:
+                # Try again next round, well before the leases run out
+                continue
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields['updated_at'] = datetime.now().isoformat()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._connection() as conn:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def _run_stage(self, job_id: str) -> None:
+        row = self._connection().execute(
+            'SELECT kind, payload, output, completed_stages FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        stages = self._kinds[row['kind']]
+        name, function = stages[row['completed_stages']]
+        previous = json.loads(row['output']) if row['output'] is not None else None
+
+        self._start_heartbeat()
+        self._update(job_id, status='running', stage=name)
+        future = self._pool().submit(function, json.loads(row['payload']), previous)
+        future.add_done_callback(lambda f: self._stage_done(job_id, f))
+
+    def _stage_done(self, job_id: str, future) -> None:
+        row = self._connection().execute(
+            'SELECT kind, payload, completed_stages FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        stages = self._kinds[row['kind']]
+
+        try:
+            output = future.result()
+        except Exception as e:
+            self._update(job_id, status='failed', error=str(e))
+            return
+
+        completed = row['completed_stages'] + 1
+        if completed == len(stages):
+            self._update(job_id, status='done', stage=None, completed_stages=completed,
+                         output=json.dumps(output))
+        else:
+            self._update(job_id, completed_stages=completed, output=json.dumps(output))
+            self._run_stage(job_id)
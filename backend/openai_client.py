@@ -0,0 +1,137 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import openai
+from openai import OpenAI
+
+# Defaults for every call, overridable with configure() or per call
+SETTINGS = {
+    'base_url': os.getenv('OPENAI_BASE_URL') or None,
+    'timeout': float(os.getenv('EERIS_OPENAI_TIMEOUT', '30')),
+    'max_retries': int(os.getenv('EERIS_OPENAI_MAX_RETRIES', '3')),
+    'backoff_base': float(os.getenv('EERIS_OPENAI_BACKOFF_BASE', '0.5')),
+    'backoff_cap': float(os.getenv('EERIS_OPENAI_BACKOFF_CAP', '8')),
+}
+
+_clients: Dict[tuple, OpenAI] = {}
+_clients_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    'requests': 0,
+    'retries': 0,
+    'failures': 0,
+    'total_latency_ms': 0.0,
+    'last_latency_ms': 0.0,
+}
+
+
+def configure(**settings) -> None:
+    """
+    Override client settings, e.g. to point at a local stand-in server in tests.
+
+    Args:
+        **settings: Any of base_url, timeout, max_retries, backoff_base, backoff_cap
+    """
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown OpenAI client settings: {', '.join(sorted(unknown))}")
+    SETTINGS.update(settings)
+    with _clients_lock:
+        _clients.clear()
+
+
+def get_client(api_key: str) -> OpenAI:
+    """
+    Return the shared client for an API key, creating it on first use.
+
+    The client keeps its HTTP connection pool (and TLS sessions) between
+    calls. Its built-in retries are disabled; call_with_retries handles them.
+    """
+    key = (api_key, SETTINGS['base_url'])
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                base_url=SETTINGS['base_url'],
+                timeout=SETTINGS['timeout'],
+                max_retries=0
+            )
+            _clients[key] = client
+        return client
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    # Honour an explicit Retry-After, otherwise use full-jitter exponential backoff
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), SETTINGS['backoff_cap'])
+        except ValueError:
+            pass
+    ceiling = min(SETTINGS['backoff_cap'], SETTINGS['backoff_base'] * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+def chat_completion(api_key: str, timeout: Optional[float] = None, **kwargs) -> Any:
+    """
+    Create a chat completion on the shared client, retrying transient failures.
+
+    Rate limits (429), server errors (5xx), timeouts and connection errors
+    are retried up to max_retries times with jittered exponential backoff.
+
+    Args:
+        api_key: OpenAI API key
+        timeout: Per-call timeout in seconds (default from settings)
+        **kwargs: Passed to client.chat.completions.create
+
+    Returns:
+        The completion (or stream, when stream=True)
+    """
+    client = get_client(api_key)
+    timeout = SETTINGS['timeout'] if timeout is None else timeout
+
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            response = client.chat.completions.create(timeout=timeout, **kwargs)
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= SETTINGS['max_retries']:
+                with _stats_lock:
+                    _stats['failures'] += 1
+                raise
+            with _stats_lock:
+                _stats['retries'] += 1
+            time.sleep(_retry_delay(e, attempt))
+            attempt += 1
+            continue
+
+        latency = (time.perf_counter() - start) * 1000
+        with _stats_lock:
+            _stats['requests'] += 1
+            _stats['total_latency_ms'] += latency
+            _stats['last_latency_ms'] = latency
+        return response
+
+
+def stats() -> Dict[str, Any]:
+    """
+    Report call, retry and latency counters.
+    """
+    with _stats_lock:
+        report = dict(_stats)
+    report['mean_latency_ms'] = (
+        report['total_latency_ms'] / report['requests'] if report['requests'] else 0.0
+    )
+    return report
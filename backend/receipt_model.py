@@ -0,0 +1,154 @@
+from dataclasses import dataclass, field
+from datetime import date as Date, datetime, time as Time
+from typing import Dict, Any, List, Optional
+
+from amounts import amount_cents
+
+# Date formats seen in parsed and hand-edited receipts, tried in order
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%m-%d-%Y', '%Y/%m/%d', '%d.%m.%Y', '%b %d, %Y', '%B %d, %Y')
+TIME_FORMATS = ('%H:%M', '%H:%M:%S', '%I:%M %p', '%I:%M%p', '%I:%M:%S %p')
+
+# Fields with a typed attribute; anything else is carried through untouched
+TEXT_FIELDS = ('id', 'store_name', 'phone', 'website', 'address', 'payment_method',
+               'expense_category', 'image_filename', 'status', 'processed_at')
+
+
+def parse_date(value: Any) -> Optional[Date]:
+    if isinstance(value, Date):
+        return value
+    text = str(value or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_time(value: Any) -> Optional[Time]:
+    if isinstance(value, Time):
+        return value
+    text = str(value or '').strip().upper()
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).time()
+        except ValueError:
+            continue
+    return None
+
+
+def format_cents(cents: int) -> str:
+    """
+    Format integer cents the way receipts display totals, e.g. '$12.50'.
+    """
+    sign = '-' if cents < 0 else ''
+    return f"{sign}${abs(cents) / 100:.2f}"
+
+
+@dataclass(slots=True)
+class Receipt:
+    """
+    A receipt with its values parsed once: the total in integer cents and
+    the date and time as date/time objects. id is assigned by storage when
+    the receipt is first saved and never changes.
+
+    from_dict/to_dict convert from and to the JSON shape stored and served
+    by the API. Values that cannot be parsed keep their original text in
+    extra, so nothing a user typed is lost.
+    """
+    id: str = ''
+    processed_at: str = ''
+    store_name: str = ''
+    phone: str = ''
+    website: str = ''
+    address: str = ''
+    date: Optional[Date] = None
+    time: Optional[Time] = None
+    line_items: List[str] = field(default_factory=list)
+    total_cents: Optional[int] = None
+    payment_method: str = ''
+    expense_category: str = ''
+    image_filename: str = ''
+    status: str = ''
+    username: str = ''
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Receipt':
+        """
+        Build a record from receipt JSON.
+
+        The displayed total_payment wins over a stored total_cents, so an
+        edited total is never shadowed by a stale cents value.
+        """
+        extra = {k: v for k, v in data.items()
+                 if k not in TEXT_FIELDS and k not in ('date', 'time', 'line_items',
+                                                      'total_payment', 'total_cents', 'username')}
+
+        total_cents = None
+        total_payment = data.get('total_payment')
+        if total_payment not in (None, ''):
+            total_cents = amount_cents(total_payment)
+            if total_cents is None:
+                # Kept as typed, e.g. '12.50 - 2.00'; it counts as no total
+                extra['total_payment'] = total_payment
+        elif isinstance(data.get('total_cents'), int):
+            total_cents = data['total_cents']
+
+        receipt_date = parse_date(data.get('date'))
+        if receipt_date is None and data.get('date'):
+            extra['date'] = data['date']
+        receipt_time = parse_time(data.get('time'))
+        if receipt_time is None and data.get('time'):
+            extra['time'] = data['time']
+
+        return cls(
+            date=receipt_date,
+            time=receipt_time,
+            line_items=[str(item) for item in (data.get('line_items') or [])],
+            total_cents=total_cents,
+            username=data.get('username') or '',
+            extra=extra,
+            **{name: str(data.get(name) or '') for name in TEXT_FIELDS}
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Serialize to receipt JSON, with total_payment formatted from the cents
+        and a total_cents field alongside it.
+        """
+        data = {
+            'id': self.id,
+            'store_name': self.store_name,
+            'phone': self.phone,
+            'website': self.website,
+            'address': self.address,
+            'date': self.date.isoformat() if self.date else self.extra.get('date', ''),
+            'time': self.time.strftime('%H:%M') if self.time else self.extra.get('time', ''),
+            'line_items': list(self.line_items),
+            'total_payment': (format_cents(self.total_cents) if self.total_cents is not None
+                              else self.extra.get('total_payment', '')),
+            'total_cents': self.total_cents,
+            'payment_method': self.payment_method,
+            'expense_category': self.expense_category,
+            'image_filename': self.image_filename,
+            'status': self.status,
+            'processed_at': self.processed_at,
+        }
+        for key, value in self.extra.items():
+            data.setdefault(key, value)
+        if self.username:
+            data['username'] = self.username
+        return data
+
+    @property
+    def month(self) -> str:
+        return self.date.strftime('%Y-%m') if self.date else ''
+
+
+def normalize_receipt(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Round-trip receipt JSON through Receipt: canonical '$X.XX' totals with
+    total_cents, ISO dates and 24-hour times.
+    """
+    return Receipt.from_dict(data).to_dict()
@@ -0,0 +1,132 @@
+import os
+from typing import Dict, Any, List, Optional
+
+from content_cache import ContentCache
+from image_to_text import extract_text_with_source, OCR_PREPROCESS, TESSERACT_PSM, TESSERACT_OEM
+from text_scrapper import parse_receipt_text, parse_receipt_texts, PARSE_MODE
+from thumbnails import EAGER_THUMBNAILS, thumbnail_stage
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# OCR text and parsed fields of past uploads, keyed by the upload's SHA-256
+CONTENT_CACHE_DB = os.getenv(
+    'EERIS_CONTENT_CACHE_PATH', os.path.join(BASE_DIR, 'database', 'content_cache.db')
+)
+CONTENT_CACHE_MAX_BYTES = int(os.getenv('EERIS_CONTENT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# OCR output differs between preprocessing presets and Tesseract modes, and
+# parse results between parse modes, so each combination gets its own entries
+OCR_SETTINGS = f'{OCR_PREPROCESS}:{TESSERACT_PSM}:{TESSERACT_OEM}'
+OCR_CACHE_KIND = f'extracted_text:{OCR_SETTINGS}'
+FIELDS_CACHE_KIND = f'receipt_fields:{PARSE_MODE}:{OCR_SETTINGS}'
+
+_content_cache = None
+
+
+def get_content_cache() -> ContentCache:
+    """
+    Return this process's handle on the content cache, opening it on first use.
+    """
+    global _content_cache
+    if _content_cache is None:
+        _content_cache = ContentCache(CONTENT_CACHE_DB, CONTENT_CACHE_MAX_BYTES)
+    return _content_cache
+
+
+def ocr_stage(payload: Dict[str, Any], previous: Any = None) -> Dict[str, str]:
+    """
+    Job stage: extract the raw text from an uploaded receipt file.
+
+    Args:
+        payload: Job payload with the uploaded file's 'filepath' and,
+            optionally, its 'content_hash'
+        previous: Unused, this is the first stage
+
+    Returns:
+        Dictionary with the extracted 'text' and its 'text_source'
+        ('text_layer', 'ocr' or 'mixed')
+    """
+    content_hash = payload.get('content_hash')
+    if content_hash:
+        cached = get_content_cache().get(OCR_CACHE_KIND, content_hash)
+        if cached is not None:
+            return cached
+
+    text, source = extract_text_with_source(payload['filepath'])
+    extracted = {'text': text, 'text_source': source}
+    if content_hash:
+        get_content_cache().put(OCR_CACHE_KIND, content_hash, extracted)
+    return extracted
+
+
+def parse_stage(payload: Dict[str, Any], extracted: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Job stage: turn OCR text into structured receipt fields.
+
+    Args:
+        payload: Job payload with the stored 'image_filename'
+        extracted: Output of ocr_stage
+
+    Returns:
+        Parsed receipt data, ready to be reviewed and saved
+    """
+    content_hash = payload.get('content_hash')
+    receipt_data = get_content_cache().get(FIELDS_CACHE_KIND, content_hash) if content_hash else None
+
+    if receipt_data is None:
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key and PARSE_MODE != 'local':
+            raise RuntimeError('OpenAI API key not set')
+
+        receipt_data = parse_receipt_text(extracted['text'], api_key)
+        if content_hash:
+            get_content_cache().put(FIELDS_CACHE_KIND, content_hash, receipt_data)
+
+    receipt_data['image_filename'] = payload['image_filename']
+    return receipt_data
+
+
+def parse_batch_stage(
+    payloads: List[Dict[str, Any]],
+    extracted: List[Dict[str, str]]
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Parse several uploads at once, sharing LLM requests between them.
+
+    Args:
+        payloads: Job payloads of the uploads
+        extracted: ocr_stage output for each payload, in the same order
+
+    Returns:
+        Parsed receipt data for each payload, or None where parsing failed
+    """
+    results = []
+    missing = []
+    for position, payload in enumerate(payloads):
+        content_hash = payload.get('content_hash')
+        cached = get_content_cache().get(FIELDS_CACHE_KIND, content_hash) if content_hash else None
+        results.append(cached)
+        if cached is None:
+            missing.append(position)
+
+    if missing:
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key and PARSE_MODE != 'local':
+            raise RuntimeError('OpenAI API key not set')
+
+        parsed = parse_receipt_texts([extracted[position]['text'] for position in missing], api_key)
+        for position, receipt_data in zip(missing, parsed):
+            content_hash = payloads[position].get('content_hash')
+            if receipt_data is not None and content_hash:
+                get_content_cache().put(FIELDS_CACHE_KIND, content_hash, receipt_data)
+            results[position] = receipt_data
+
+    for payload, receipt_data in zip(payloads, results):
+        if receipt_data is not None:
+            receipt_data['image_filename'] = payload['image_filename']
+    return results
+
+
+RECEIPT_STAGES = [('ocr', ocr_stage), ('parse', parse_stage)]
+if EAGER_THUMBNAILS:
+    RECEIPT_STAGES.append(('thumbnails', thumbnail_stage))
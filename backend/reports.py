@@ -0,0 +1,172 @@
+import os
+import tempfile
+from datetime import date
+from typing import Dict, Any, List, Optional
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph
+
+import storage
+from cache import prune_directory
+from receipt_model import Receipt, format_cents
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generated team reports, one file per supervisor and version of the team's data
+REPORTS_DIR = os.getenv('EERIS_REPORTS_DIR', os.path.join(BASE_DIR, 'database', 'reports'))
+REPORTS_MAX_BYTES = int(os.getenv('EERIS_REPORTS_MAX_BYTES', str(50 * 1024 * 1024)))
+# Reports with more receipts than this are built by the job queue
+BACKGROUND_ROWS = int(os.getenv('EERIS_REPORT_BACKGROUND_ROWS', '500'))
+
+HEADER = ['Username', 'Date', 'Amount', 'Category', 'Status']
+
+
+def report_path(supervisor: str, data_version: str) -> str:
+    """
+    Where the report of a supervisor's team at a given data version is kept.
+    """
+    return os.path.join(REPORTS_DIR, f"team_report_{supervisor}_{data_version[:16]}.pdf")
+
+
+def cached_report(supervisor: str, data_version: str) -> Optional[str]:
+    """
+    Return the path of an already generated report, or None.
+
+    A hit refreshes the file's access time so the size cap evicts it last.
+    """
+    path = report_path(supervisor, data_version)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def build_team_report(supervisor: str, receipts: List[Receipt], path: str) -> str:
+    """
+    Render a team report PDF.
+
+    Receipts are grouped by user, each group followed by a subtotal row,
+    and the table header repeats on every page.
+
+    Args:
+        supervisor: Supervisor the report is for
+        receipts: The team's receipts, as typed records
+        path: Destination file; written atomically
+
+    Returns:
+        The path written
+    """
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        spaceAfter=30
+    )
+    elements = [Paragraph(f"Team Report for {supervisor}'s Team", title_style)]
+
+    table_data = [HEADER]
+    subtotal_rows = []
+    by_user: Dict[str, List[Receipt]] = {}
+    for receipt in receipts:
+        by_user.setdefault(receipt.username, []).append(receipt)
+
+    grand_total = 0
+    for username in sorted(by_user):
+        user_receipts = sorted(by_user[username], key=lambda receipt: receipt.date or date.min)
+        user_total = sum(receipt.total_cents or 0 for receipt in user_receipts)
+        for receipt in user_receipts:
+            table_data.append([
+                username,
+                receipt.date.isoformat() if receipt.date else 'N/A',
+                format_cents(receipt.total_cents or 0),
+                receipt.expense_category or 'N/A',
+                receipt.status or 'N/A'
+            ])
+        subtotal_rows.append(len(table_data))
+        count = len(user_receipts)
+        table_data.append([f"{username} subtotal", f"{count} receipt{'s' if count != 1 else ''}",
+                           format_cents(user_total), '', ''])
+        grand_total += user_total
+    table_data.append(['Total', f"{len(receipts)} receipts", format_cents(grand_total), '', ''])
+
+    style = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ]
+    for row in subtotal_rows:
+        style += [
+            ('BACKGROUND', (0, row), (-1, row), colors.lightgrey),
+            ('FONTNAME', (0, row), (-1, row), 'Helvetica-Bold'),
+        ]
+
+    # LongTable lays out big tables in linear time and splits them across pages
+    table = LongTable(table_data, repeatRows=1)
+    table.setStyle(TableStyle(style))
+    elements.append(table)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        SimpleDocTemplate(tmp_path, pagesize=letter).build(elements)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    enforce_size_cap(keep=path)
+    return path
+
+
+def enforce_size_cap(keep: Optional[str] = None) -> List[str]:
+    """
+    Delete the least recently used reports until the directory fits REPORTS_MAX_BYTES.
+
+    Args:
+        keep: A report that must survive, e.g. the one just generated
+
+    Returns:
+        Paths of the deleted reports
+    """
+    return prune_directory(REPORTS_DIR, REPORTS_MAX_BYTES, keep=[keep] if keep else None, suffixes=('.pdf',))
+
+
+def report_stage(payload: Dict[str, Any], previous: Any = None) -> Dict[str, str]:
+    """
+    Job stage: build a team report in the background.
+
+    Args:
+        payload: 'supervisor', the team's 'usernames' and the store's 'db_path'
+        previous: Unused, this is the only stage
+
+    Returns:
+        Dictionary with the report's 'filename'
+    """
+    # Process-pool workers start without an open store
+    if storage.current_db_path() != payload['db_path']:
+        storage.init_db(payload['db_path'])
+
+    # File the report under the version of the data it was actually built
+    # from, which may be newer than the one the job was queued for
+    path = report_path(payload['supervisor'], storage.receipts_version(payload['usernames']))
+    receipts = storage.list_receipt_records(payload['usernames'])
+    if not os.path.exists(path):
+        build_team_report(payload['supervisor'], receipts, path)
+    return {'filename': os.path.basename(path)}
+
+
+REPORT_STAGES = [('render', report_stage)]
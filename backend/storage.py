@@ -0,0 +1,1150 @@
+import base64
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterable, FrozenSet, Set, Tuple, Callable
+
+from amounts import receipt_cents, receipt_month
+from cache import ReadThroughCache
+from receipt_model import Receipt, normalize_receipt, parse_date
+
+# Schema migrations, applied in order. PRAGMA user_version records how many
+# have run against a given database file.
+MIGRATIONS = [
+    """
+    CREATE TABLE meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+
+    CREATE TABLE users (
+        username TEXT PRIMARY KEY,
+        role TEXT NOT NULL DEFAULT 'user',
+        data TEXT NOT NULL
+    );
+    CREATE INDEX idx_users_role ON users (role);
+
+    CREATE TABLE receipts (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        processed_at TEXT NOT NULL,
+        image_filename TEXT,
+        status TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX idx_receipts_user_key ON receipts (username, processed_at);
+
+    CREATE TABLE image_owners (
+        image_filename TEXT NOT NULL,
+        username TEXT NOT NULL,
+        PRIMARY KEY (image_filename, username)
+    ) WITHOUT ROWID;
+    """,
+    # Count and total per owner, category, month and status, kept up to date
+    # by every receipt write; filled from the existing receipts on upgrade
+    """
+    CREATE TABLE rollups (
+        username TEXT NOT NULL,
+        category TEXT NOT NULL,
+        month TEXT NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        cents INTEGER NOT NULL,
+        PRIMARY KEY (username, category, month, status)
+    ) WITHOUT ROWID;
+    """,
+    # Typed copies of the values queries filter and sum on; filled in by
+    # normalize_receipts() when an existing database is upgraded
+    """
+    ALTER TABLE receipts ADD COLUMN total_cents INTEGER;
+    ALTER TABLE receipts ADD COLUMN receipt_date TEXT;
+    ALTER TABLE receipts ADD COLUMN category TEXT;
+    """,
+    # Keyset pagination for query_receipts: each index keeps every owner's
+    # receipts presorted by one sort key, plus global orderings for admins
+    """
+    CREATE INDEX idx_receipts_user_seq ON receipts (username, seq);
+    CREATE INDEX idx_receipts_user_date ON receipts (username, IFNULL(receipt_date, ''), seq);
+    CREATE INDEX idx_receipts_user_total ON receipts (username, IFNULL(total_cents, 0), seq);
+    CREATE INDEX idx_receipts_user_status ON receipts (username, status, seq);
+    CREATE INDEX idx_receipts_user_category ON receipts (username, category, seq);
+    CREATE INDEX idx_receipts_date ON receipts (IFNULL(receipt_date, ''), seq);
+    CREATE INDEX idx_receipts_total ON receipts (IFNULL(total_cents, 0), seq);
+    """,
+    # Every receipt write takes the next value of a global counter, so a
+    # listing's version is the largest version among its receipts
+    """
+    ALTER TABLE receipts ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    UPDATE receipts SET version = seq;
+    INSERT INTO meta (key, value)
+        VALUES ('receipt_version', (SELECT IFNULL(MAX(seq), 0) FROM receipts));
+    CREATE INDEX idx_receipts_user_version ON receipts (username, version);
+    CREATE INDEX idx_receipts_version ON receipts (version);
+    """,
+    # Immutable receipt ids, also kept in the receipt JSON as 'id'; existing
+    # rows are given one by assign_receipt_ids()
+    """
+    ALTER TABLE receipts ADD COLUMN receipt_id TEXT;
+    CREATE UNIQUE INDEX idx_receipts_id ON receipts (receipt_id);
+    """,
+]
+# Migrations followed by a data backfill in init_db()
+ROLLUPS_MIGRATION = 2
+NORMALIZED_MIGRATION = 3
+RECEIPT_IDS_MIGRATION = 6
+
+ROLLUP_DIMENSIONS = ('username', 'category', 'month', 'status')
+
+# Writes are appended to the write-ahead log; every COMPACT_EVERY committed
+# transactions the log is folded back into the main database file.
+COMPACT_EVERY = int(os.getenv('EERIS_COMPACT_EVERY', '500'))
+
+_db_path = None
+_local = threading.local()
+_writes_since_compact = 0
+_compact_lock = threading.Lock()
+
+
+def _watched_files() -> List[str]:
+    return [_db_path, _db_path + '-wal'] if _db_path else []
+
+
+# Decoded rows, dropped when the database file changes or we write to it
+_cache = ReadThroughCache(
+    _watched_files, max_entries=int(os.getenv('EERIS_STORAGE_CACHE_ENTRIES', '4096'))
+)
+
+
+def init_db(db_path: str) -> None:
+    """
+    Point the storage layer at a database file and bring its schema up to date.
+
+    Args:
+        db_path: Path to the SQLite database file (created if missing)
+    """
+    global _db_path
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    _db_path = db_path
+    _local.__dict__.clear()
+    _cache.invalidate()
+
+    conn = get_connection()
+    # WAL mode is persistent, so setting it once per file is enough. Opening
+    # the database replays any log left behind by a crash.
+    conn.execute('PRAGMA journal_mode = WAL')
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for index, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        # user_version is transactional, so a migration and its number
+        # commit together
+        try:
+            conn.executescript(f'BEGIN IMMEDIATE; {script}; PRAGMA user_version = {index}; COMMIT;')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+    if version < NORMALIZED_MIGRATION <= len(MIGRATIONS):
+        normalize_receipts()
+    if version < ROLLUPS_MIGRATION <= len(MIGRATIONS) or version < NORMALIZED_MIGRATION <= len(MIGRATIONS):
+        rebuild_rollups()
+    if version < RECEIPT_IDS_MIGRATION <= len(MIGRATIONS):
+        assign_receipt_ids()
+    compact()
+
+
+def current_db_path() -> Optional[str]:
+    """
+    Path of the database init_db() opened in this process, if any.
+    """
+    return _db_path
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return this thread's connection, opening it on first use.
+    """
+    if _db_path is None:
+        raise RuntimeError("Storage not initialised, call init_db() first")
+
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        # Autocommit mode: transaction() issues BEGIN/COMMIT itself, rather
+        # than letting the driver open a transaction at the first write
+        conn = sqlite3.connect(_db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # A commit only appends to the log; a crash can lose at most the
+        # last transaction, never corrupt the database
+        conn.execute('PRAGMA synchronous = NORMAL')
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction():
+    """
+    Run the enclosed statements in a single write transaction.
+
+    The write lock is taken up front (BEGIN IMMEDIATE), so reads inside the
+    block see data no other writer can change before the commit, and
+    read-modify-write sequences are atomic.
+    """
+    global _writes_since_compact
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        _cache.invalidate()
+
+    with _compact_lock:
+        _writes_since_compact += 1
+        due = _writes_since_compact >= COMPACT_EVERY
+    if due:
+        compact()
+
+
+def compact() -> Dict[str, int]:
+    """
+    Fold the write-ahead log into the main database file and truncate it.
+
+    Returns:
+        Dictionary with the number of log frames written back and whether
+        the checkpoint was blocked by a concurrent reader
+    """
+    global _writes_since_compact
+    busy, log_frames, checkpointed = get_connection().execute(
+        'PRAGMA wal_checkpoint(TRUNCATE)'
+    ).fetchone()
+    if not busy:
+        with _compact_lock:
+            _writes_since_compact = 0
+    return {'busy': busy, 'log_frames': log_frames, 'checkpointed': checkpointed}
+
+
+def cache_stats() -> Dict[str, Any]:
+    """
+    Hit/miss counters of the in-process read cache.
+    """
+    return _cache.stats()
+
+
+def cached(key: Tuple, loader: Callable[[], Any]) -> Any:
+    """
+    Memoize a value derived from the store until the store next changes.
+
+    Args:
+        key: Tuple identifying the derived value
+        loader: Called with no arguments to build the value on a miss
+
+    Returns:
+        The shared, read-only value
+    """
+    return _cache.get(('derived',) + tuple(key), loader)
+
+
+def _decode_receipt(row: sqlite3.Row) -> Dict[str, Any]:
+    receipt = json.loads(row['data'])
+    receipt['username'] = row['username']
+    return receipt
+
+
+def _encode_receipt(receipt: Dict[str, Any]) -> str:
+    # The owner lives in its own column, so it is not duplicated in the blob
+    return json.dumps({k: v for k, v in receipt.items() if k != 'username'})
+
+
+# Columns written from a receipt, in the order _receipt_columns returns them
+RECEIPT_COLUMNS = ('receipt_id', 'processed_at', 'image_filename', 'status', 'total_cents',
+                   'receipt_date', 'category', 'version', 'data')
+
+
+def _next_version(conn: sqlite3.Connection) -> int:
+    # Runs inside the writing transaction, so versions are never reused
+    conn.execute(
+        "UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'receipt_version'"
+    )
+    return int(conn.execute("SELECT value FROM meta WHERE key = 'receipt_version'").fetchone()[0])
+
+
+def new_receipt_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _ensure_receipt_id(conn: sqlite3.Connection, receipt: Dict[str, Any]) -> None:
+    # Keep an id the receipt already carries (legacy receipts have one equal
+    # to processed_at) unless another row has it, else assign a fresh one
+    receipt_id = receipt.get('id')
+    if not receipt_id or conn.execute(
+        'SELECT 1 FROM receipts WHERE receipt_id = ?', (receipt_id,)
+    ).fetchone():
+        receipt['id'] = new_receipt_id()
+
+
+def _receipt_columns(conn: sqlite3.Connection, receipt: Dict[str, Any]) -> Tuple:
+    # receipt must already be normalized
+    return (
+        receipt.get('id') or None,
+        receipt['processed_at'],
+        receipt.get('image_filename') or None,
+        receipt.get('status'),
+        receipt.get('total_cents'),
+        receipt.get('date') if parse_date(receipt.get('date')) else None,
+        receipt.get('expense_category') or None,
+        _next_version(conn),
+        _encode_receipt(receipt),
+    )
+
+
+# --- Users -------------------------------------------------------------------
+
+def get_user(username: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up a single user record.
+
+    Args:
+        username: Username to look up
+
+    Returns:
+        The user record, or None if the user does not exist
+    """
+    def load():
+        row = get_connection().execute(
+            'SELECT data FROM users WHERE username = ?', (username,)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    user = _cache.get(('user', username), load)
+    return dict(user) if user else None
+
+
+def list_users(role: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    List users, optionally restricted to a single role.
+
+    Args:
+        role: Only return users with this role
+
+    Returns:
+        Dictionary mapping usernames to user records
+    """
+    if role is None:
+        rows = get_connection().execute('SELECT username, data FROM users ORDER BY rowid')
+    else:
+        rows = get_connection().execute(
+            'SELECT username, data FROM users WHERE role = ? ORDER BY rowid', (role,)
+        )
+    return {row['username']: json.loads(row['data']) for row in rows}
+
+
+def create_user(username: str, user: Dict[str, Any]) -> bool:
+    """
+    Insert a new user.
+
+    Args:
+        username: Username for the new account
+        user: User record (password, role, team, ...)
+
+    Returns:
+        True if the user was created, False if the username is taken
+    """
+    with transaction() as conn:
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO users (username, role, data) VALUES (?, ?, ?)',
+            (username, user.get('role', 'user'), json.dumps(user))
+        )
+    return cursor.rowcount == 1
+
+
+def save_user(username: str, user: Dict[str, Any]) -> None:
+    """
+    Overwrite an existing user record.
+
+    Args:
+        username: Username of the account to update
+        user: Complete replacement user record
+    """
+    with transaction() as conn:
+        conn.execute(
+            'UPDATE users SET role = ?, data = ? WHERE username = ?',
+            (user.get('role', 'user'), json.dumps(user), username)
+        )
+
+
+# --- Receipts ----------------------------------------------------------------
+
+def list_receipts(usernames: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """
+    List receipts belonging to the given users, in submission order.
+
+    Args:
+        usernames: Owners to include, or None for every receipt in the system
+
+    Returns:
+        List of receipt dictionaries, each with its owner under 'username'
+    """
+    if usernames is None:
+        cached = _cache.get(('receipts', None), _load_all_receipts)
+        return [dict(receipt) for receipt in cached]
+
+    receipts = []
+    for username in dict.fromkeys(usernames):
+        cached = _cache.get(('receipts', username), lambda: _load_user_receipts(username))
+        receipts.extend(dict(receipt) for receipt in cached)
+    return receipts
+
+
+def receipts_version(usernames: Optional[Iterable[str]] = None) -> str:
+    """
+    Fingerprint of the receipts visible to the given users.
+
+    Args:
+        usernames: Owners to include, or None for every receipt in the system
+
+    Returns:
+        Hex digest that changes whenever any of those receipts is added,
+        edited or removed, or the set of owners changes
+    """
+    owners = None if usernames is None else tuple(sorted(set(usernames)))
+    version, count = listing_version(owners)
+    return hashlib.sha256(json.dumps([owners, version, count]).encode()).hexdigest()
+
+
+def owners_fingerprint(usernames: Optional[Iterable[str]] = None) -> str:
+    """
+    Short fingerprint of a set of receipt owners (None meaning everyone).
+
+    Delta sync hands it to clients with each version, so a since= request
+    made for a different set of owners can be answered with a full listing.
+    """
+    owners = None if usernames is None else sorted(set(usernames))
+    return hashlib.sha256(json.dumps(owners).encode()).hexdigest()[:16]
+
+
+def _owner_condition(owners: Optional[Tuple[str, ...]]) -> Tuple[str, Tuple]:
+    if owners is None:
+        return '1', ()
+    return f"username IN ({', '.join('?' * len(owners))})", owners
+
+
+def listing_version(usernames: Optional[Iterable[str]] = None) -> Tuple[int, int]:
+    """
+    Current version and size of the receipt listing for the given users.
+
+    The version is the highest receipt version among them: it grows with
+    every write to any of their receipts and never goes back.
+
+    Returns:
+        (version, number of receipts)
+    """
+    owners = None if usernames is None else tuple(sorted(set(usernames)))
+    condition, params = _owner_condition(owners)
+
+    def load():
+        row = get_connection().execute(
+            f'SELECT IFNULL(MAX(version), 0), COUNT(*) FROM receipts WHERE {condition}', params
+        ).fetchone()
+        return row[0], row[1]
+
+    return cached(('listing_version', owners), load)
+
+
+def receipts_changed_since(
+    usernames: Optional[Iterable[str]],
+    since: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Receipts added or changed after a listing version.
+
+    Only valid for the owners the version was handed out for: receipts of an
+    owner added to the set since then are older than the version and are
+    not returned. Check owners_fingerprint before relying on the result.
+
+    Args:
+        usernames: Owners to include, or None for every receipt in the system
+        since: A version previously returned by listing_version
+
+    Returns:
+        The changed receipts, oldest change first, and the version to pass
+        as since next time
+    """
+    owners = None if usernames is None else tuple(sorted(set(usernames)))
+    condition, params = _owner_condition(owners)
+    # A single statement sees one snapshot, so the version matches the rows
+    rows = get_connection().execute(
+        f'SELECT username, data, version FROM receipts WHERE {condition} AND version > ? '
+        'ORDER BY version',
+        (*params, since)
+    ).fetchall()
+    version = max([since] + [row['version'] for row in rows])
+    return [_decode_receipt(row) for row in rows], version
+
+
+# Sort keys accepted by query_receipts and the indexed expression behind each
+RECEIPT_SORTS = {
+    'submitted': 'seq',
+    'date': "IFNULL(receipt_date, '')",
+    'total': 'IFNULL(total_cents, 0)',
+}
+# Types of the values in a cursor for each sort: the sort value, then seq
+CURSOR_TYPES = {
+    'submitted': (int,),
+    'date': (str, int),
+    'total': (int, int),
+}
+MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor: str, sort: str) -> List[Any]:
+    # A cursor must hold exactly the values its sort binds, of the right types
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    types = CURSOR_TYPES[sort]
+    if not isinstance(values, list) or len(values) != len(types) or not all(
+        isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(values, types)
+    ):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def query_receipts(
+    usernames: Optional[Iterable[str]] = None,
+    statuses: Iterable[str] = (),
+    categories: Iterable[str] = (),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    sort: str = 'submitted',
+    descending: bool = False,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[Iterable[str]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Fetch one page of receipts, filtered and sorted in SQLite.
+
+    Pages are cut with keyset pagination over the per-owner sorted indexes,
+    so a page costs the same however many receipts are stored. With several
+    owners, each owner's index is read separately, up to one page, and the
+    results are merged; an IN list over the owners would sort all their rows.
+
+    Args:
+        usernames: Owners to include, or None for every receipt in the system
+        statuses: Only receipts with one of these statuses
+        categories: Only receipts in one of these expense categories
+        date_from: Earliest receipt date, 'YYYY-MM-DD', inclusive
+        date_to: Latest receipt date, 'YYYY-MM-DD', inclusive
+        sort: One of RECEIPT_SORTS
+        descending: Sort newest/largest first
+        limit: Page size, at most MAX_PAGE_SIZE
+        cursor: next_cursor of the previous page
+        fields: Receipt fields to return (id, username and processed_at
+            are always included); None for all of them
+
+    Returns:
+        The page of receipts and the cursor of the next page (None on the last page)
+    """
+    if sort not in RECEIPT_SORTS:
+        raise ValueError(f"Unknown sort: {sort}")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    key = RECEIPT_SORTS[sort]
+
+    conditions = []
+    params: List[Any] = []
+    for column, values in (('status', statuses), ('category', categories)):
+        values = list(dict.fromkeys(values))
+        if values:
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    if date_from:
+        conditions.append('receipt_date >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append('receipt_date <= ?')
+        params.append(date_to)
+
+    comparison = '<' if descending else '>'
+    if cursor:
+        position = _decode_cursor(cursor, sort)
+        if key == 'seq':
+            conditions.append(f'seq {comparison} ?')
+        else:
+            conditions.append(f'({key}, seq) {comparison} (?, ?)')
+        params.extend(position)
+
+    direction = 'DESC' if descending else 'ASC'
+    order = f'seq {direction}' if key == 'seq' else f'{key} {direction}, seq {direction}'
+    owners = None if usernames is None else list(dict.fromkeys(usernames))
+    conn = get_connection()
+
+    def select(columns: str, owner_conditions: List[str], owner_params: List[Any]) -> List[sqlite3.Row]:
+        sql = f'SELECT {columns} FROM receipts'
+        if owner_conditions + conditions:
+            sql += ' WHERE ' + ' AND '.join(owner_conditions + conditions)
+        sql += f' ORDER BY {order} LIMIT ?'
+        return conn.execute(sql, (*owner_params, *params, limit + 1)).fetchall()
+
+    if owners is not None and len(owners) > 1:
+        # Only positions are read per owner; data is fetched for the page alone
+        pages = []
+        for owner in owners:
+            owner_rows = select(f'seq, {key} AS sort_value', ['username = ?'], [owner])
+            pages.append([(row['sort_value'], row['seq']) for row in owner_rows])
+        positions = list(heapq.merge(*pages, reverse=descending))[:limit + 1]
+        by_seq = {row['seq']: row for row in conn.execute(
+            f"SELECT seq, username, data FROM receipts WHERE seq IN ({', '.join('?' * len(positions))})",
+            [seq for _, seq in positions]
+        )}
+        rows = [{'seq': seq, 'sort_value': value, 'username': by_seq[seq]['username'], 'data': by_seq[seq]['data']}
+                for value, seq in positions if seq in by_seq]
+    else:
+        owner_conditions = [] if owners is None else [f"username IN ({', '.join('?' * len(owners))})"]
+        rows = select(f'seq, username, data, {key} AS sort_value', owner_conditions, owners or [])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor([last['seq']] if key == 'seq' else [last['sort_value'], last['seq']])
+
+    receipts = [_decode_receipt(row) for row in rows]
+    if fields is not None:
+        keep = set(fields) | {'id', 'username', 'processed_at'}
+        receipts = [{k: v for k, v in receipt.items() if k in keep} for receipt in receipts]
+    return receipts, next_cursor
+
+
+def _load_all_receipts() -> List[Dict[str, Any]]:
+    rows = get_connection().execute('SELECT username, data FROM receipts ORDER BY seq')
+    return [_decode_receipt(row) for row in rows]
+
+
+def _load_user_receipts(username: str) -> List[Dict[str, Any]]:
+    rows = get_connection().execute(
+        'SELECT username, data FROM receipts WHERE username = ? ORDER BY seq', (username,)
+    )
+    return [_decode_receipt(row) for row in rows]
+
+
+def get_receipt(username: str, processed_at: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up a single receipt by owner and submission timestamp.
+    """
+    row = get_connection().execute(
+        'SELECT username, data FROM receipts WHERE username = ? AND processed_at = ?',
+        (username, processed_at)
+    ).fetchone()
+    return _decode_receipt(row) if row else None
+
+
+def get_receipt_by_id(receipt_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up a single receipt by its id, through the unique index on receipt_id.
+    """
+    row = get_connection().execute(
+        'SELECT username, data FROM receipts WHERE receipt_id = ?', (receipt_id,)
+    ).fetchone()
+    return _decode_receipt(row) if row else None
+
+
+def add_receipt(username: str, receipt: Dict[str, Any]) -> str:
+    """
+    Store a newly submitted receipt.
+
+    Args:
+        username: Owner of the receipt
+        receipt: Receipt data, including 'processed_at'; an 'id' is assigned
+            if it has none
+
+    Returns:
+        The receipt's id
+    """
+    receipt = normalize_receipt(receipt)
+    image_filename = receipt.get('image_filename')
+    with transaction() as conn:
+        _ensure_receipt_id(conn, receipt)
+        conn.execute(
+            f"INSERT INTO receipts (username, {', '.join(RECEIPT_COLUMNS)}) "
+            f"VALUES (?, {', '.join('?' * len(RECEIPT_COLUMNS))})",
+            (username, *_receipt_columns(conn, receipt))
+        )
+        if image_filename:
+            conn.execute(
+                'INSERT OR IGNORE INTO image_owners (image_filename, username) VALUES (?, ?)',
+                (image_filename, username)
+            )
+        _apply_rollup(conn, username, receipt, 1)
+    return receipt['id']
+
+
+def _update_receipt_row(
+    condition: str,
+    params: Tuple,
+    changes: Dict[str, Any],
+    preserved_fields: Iterable[str]
+) -> Optional[Dict[str, Any]]:
+    with transaction() as conn:
+        row = conn.execute(
+            f'SELECT seq, username, data FROM receipts WHERE {condition}', params
+        ).fetchone()
+        if row is None:
+            return None
+
+        username = row['username']
+        receipt = _decode_receipt(row)
+        _apply_rollup(conn, username, receipt, -1)
+        old_image = receipt.get('image_filename')
+        changes = {k: v for k, v in changes.items()
+                   if k not in ('id', 'username') and not (k in preserved_fields and k in receipt)}
+        receipt.update(changes)
+        receipt = normalize_receipt(receipt)
+
+        conn.execute(
+            f"UPDATE receipts SET {', '.join(f'{name} = ?' for name in RECEIPT_COLUMNS)} "
+            'WHERE seq = ?',
+            (*_receipt_columns(conn, receipt), row['seq'])
+        )
+        _reindex_image(conn, username, old_image, receipt.get('image_filename'))
+        _apply_rollup(conn, username, receipt, 1)
+    return receipt
+
+
+def update_receipt(
+    username: str,
+    processed_at: str,
+    changes: Dict[str, Any],
+    preserved_fields: Iterable[str] = ()
+) -> Optional[Dict[str, Any]]:
+    """
+    Merge changes into an existing receipt.
+
+    Args:
+        username: Owner of the receipt
+        processed_at: Submission timestamp identifying the receipt
+        changes: Fields to overwrite
+        preserved_fields: Fields that keep their stored value if already present
+
+    Returns:
+        The updated receipt, or None if no receipt matched
+    """
+    return _update_receipt_row('username = ? AND processed_at = ?', (username, processed_at),
+                               changes, preserved_fields)
+
+
+def update_receipt_by_id(
+    receipt_id: str,
+    changes: Dict[str, Any],
+    preserved_fields: Iterable[str] = ()
+) -> Optional[Dict[str, Any]]:
+    """
+    Merge changes into the receipt with the given id.
+
+    The id and the owner never change; 'id' and 'username' in changes are
+    ignored.
+
+    Args:
+        receipt_id: Id assigned when the receipt was saved
+        changes: Fields to overwrite
+        preserved_fields: Fields that keep their stored value if already present
+
+    Returns:
+        The updated receipt, or None if no receipt has that id
+    """
+    return _update_receipt_row('receipt_id = ?', (receipt_id,), changes, preserved_fields)
+
+
+def set_receipt_status(username: str, processed_at: str, status: str) -> bool:
+    """
+    Change the approval status of a receipt.
+
+    Returns:
+        True if the receipt was found and updated
+    """
+    return update_receipt(username, processed_at, {'status': status}) is not None
+
+
+def _reindex_image(conn: sqlite3.Connection, username: str,
+                   old_image: Optional[str], new_image: Optional[str]) -> None:
+    if old_image == new_image:
+        return
+    if new_image:
+        conn.execute(
+            'INSERT OR IGNORE INTO image_owners (image_filename, username) VALUES (?, ?)',
+            (new_image, username)
+        )
+    if old_image:
+        still_used = conn.execute(
+            'SELECT 1 FROM receipts WHERE username = ? AND image_filename = ? LIMIT 1',
+            (username, old_image)
+        ).fetchone()
+        if not still_used:
+            conn.execute(
+                'DELETE FROM image_owners WHERE image_filename = ? AND username = ?',
+                (old_image, username)
+            )
+
+
+def get_image_owners(image_filename: str) -> FrozenSet[str]:
+    """
+    Return the usernames whose receipts reference an uploaded file.
+
+    This sits on the thumbnail hot path, so results are served from the
+    read cache and only hit the index on a miss.
+    """
+    def load():
+        rows = get_connection().execute(
+            'SELECT username FROM image_owners WHERE image_filename = ?', (image_filename,)
+        )
+        return frozenset(row['username'] for row in rows)
+
+    return _cache.get(('image_owners', image_filename), load)
+
+
+def referenced_images() -> Set[str]:
+    """
+    Return the image_filename of every stored receipt, for upload garbage collection.
+    """
+    rows = get_connection().execute(
+        'SELECT DISTINCT image_filename FROM receipts '
+        "WHERE image_filename IS NOT NULL AND image_filename != ''"
+    )
+    return {row['image_filename'] for row in rows}
+
+
+def rebuild_image_index() -> Dict[str, int]:
+    """
+    Recreate the image ownership index from the receipts table.
+
+    Returns:
+        Dictionary with the number of index rows added and removed
+    """
+    with transaction() as conn:
+        expected = {tuple(row) for row in conn.execute(
+            'SELECT DISTINCT image_filename, username FROM receipts '
+            "WHERE image_filename IS NOT NULL AND image_filename != ''"
+        )}
+        current = {tuple(row) for row in conn.execute(
+            'SELECT image_filename, username FROM image_owners'
+        )}
+        conn.executemany(
+            'DELETE FROM image_owners WHERE image_filename = ? AND username = ?',
+            current - expected
+        )
+        conn.executemany(
+            'INSERT INTO image_owners (image_filename, username) VALUES (?, ?)',
+            expected - current
+        )
+    return {'added': len(expected - current), 'removed': len(current - expected)}
+
+
+def normalize_receipts() -> int:
+    """
+    Rewrite every stored receipt in normalized form (see receipt_model).
+
+    Returns:
+        Number of receipts whose stored form changed
+    """
+    changed = 0
+    with transaction() as conn:
+        rows = conn.execute('SELECT seq, username, data FROM receipts').fetchall()
+        for row in rows:
+            receipt = normalize_receipt(_decode_receipt(row))
+            if _encode_receipt(receipt) == row['data']:
+                continue
+            changed += 1
+            columns = _receipt_columns(conn, receipt)
+            conn.execute(
+                f"UPDATE receipts SET {', '.join(f'{name} = ?' for name in RECEIPT_COLUMNS)} "
+                'WHERE seq = ?',
+                (*columns, row['seq'])
+            )
+    return changed
+
+
+def assign_receipt_ids() -> int:
+    """
+    Give every stored receipt without an id one (see _ensure_receipt_id).
+
+    Returns:
+        Number of receipts that were given an id
+    """
+    assigned = 0
+    with transaction() as conn:
+        rows = conn.execute(
+            'SELECT seq, username, data FROM receipts WHERE receipt_id IS NULL ORDER BY seq'
+        ).fetchall()
+        for row in rows:
+            receipt = _decode_receipt(row)
+            _ensure_receipt_id(conn, receipt)
+            # A new version, so clients syncing deltas pick up the id
+            conn.execute(
+                'UPDATE receipts SET receipt_id = ?, data = ?, version = ? WHERE seq = ?',
+                (receipt['id'], _encode_receipt(receipt), _next_version(conn), row['seq'])
+            )
+            assigned += 1
+    return assigned
+
+
+def list_receipt_records(usernames: Optional[Iterable[str]] = None) -> List[Receipt]:
+    """
+    Typed counterpart of list_receipts, for code that computes with totals
+    and dates rather than passing receipts through to the client.
+    """
+    return [Receipt.from_dict(receipt) for receipt in list_receipts(usernames)]
+
+
+# --- Spending rollups --------------------------------------------------------
+
+def _rollup_key(username: str, receipt: Dict[str, Any]) -> Tuple[str, str, str, str]:
+    return (
+        username,
+        receipt.get('expense_category') or '',
+        receipt_month(receipt.get('date')),
+        receipt.get('status') or '',
+    )
+
+
+def _apply_rollup(conn: sqlite3.Connection, username: str,
+                  receipt: Dict[str, Any], sign: int) -> None:
+    # Add (sign=1) or remove (sign=-1) one receipt's contribution
+    key = _rollup_key(username, receipt)
+    cents = receipt_cents(receipt)
+    conn.execute(
+        'INSERT INTO rollups (username, category, month, status, count, cents) '
+        'VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (username, category, month, status) DO UPDATE SET '
+        'count = count + excluded.count, cents = cents + excluded.cents',
+        (*key, sign, sign * cents)
+    )
+    if sign < 0:
+        conn.execute(
+            'DELETE FROM rollups WHERE username = ? AND category = ? AND month = ? '
+            'AND status = ? AND count = 0',
+            key
+        )
+
+
+def rollup_totals(
+    usernames: Optional[Iterable[str]] = None,
+    group_by: Iterable[str] = (),
+    **filters: str
+) -> List[Dict[str, Any]]:
+    """
+    Count and total spending from the rollups, without reading any receipt.
+
+    The cost depends on the number of distinct (owner, category, month,
+    status) groups, not on how many receipts are stored.
+
+    Args:
+        usernames: Owners to include, or None for everyone
+        group_by: Dimensions to break the totals down by, any of
+            'username', 'category', 'month' and 'status'
+        **filters: Exact values to restrict dimensions to, e.g. status='approved'
+
+    Returns:
+        One dictionary per group with the group_by values, 'count' and 'cents'
+    """
+    group_by = tuple(group_by)
+    unknown = (set(group_by) | set(filters)) - set(ROLLUP_DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Unknown rollup dimensions: {', '.join(sorted(unknown))}")
+
+    owners = None if usernames is None else tuple(sorted(set(usernames)))
+    conditions = []
+    params: List[Any] = []
+    if owners is not None:
+        conditions.append(f"username IN ({', '.join('?' * len(owners))})")
+        params.extend(owners)
+    for name, value in sorted(filters.items()):
+        conditions.append(f'{name} = ?')
+        params.append(value)
+
+    columns = ''.join(f'{name}, ' for name in group_by)
+    sql = f'SELECT {columns}SUM(count) AS count, SUM(cents) AS cents FROM rollups'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    if group_by:
+        sql += f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}"
+
+    def load():
+        rows = get_connection().execute(sql, params).fetchall()
+        return [
+            {**{name: row[name] for name in group_by},
+             'count': row['count'] or 0, 'cents': row['cents'] or 0}
+            for row in rows if row['count']
+        ]
+
+    key = ('rollups', owners, group_by, tuple(sorted(filters.items())))
+    return [dict(row) for row in _cache.get(key, load)]
+
+
+def _scan_rollups(conn: sqlite3.Connection) -> Dict[Tuple[str, str, str, str], Tuple[int, int]]:
+    totals: Dict[Tuple[str, str, str, str], List[int]] = {}
+    for row in conn.execute('SELECT username, data FROM receipts'):
+        receipt = json.loads(row['data'])
+        bucket = totals.setdefault(_rollup_key(row['username'], receipt), [0, 0])
+        bucket[0] += 1
+        bucket[1] += receipt_cents(receipt)
+    return {key: tuple(value) for key, value in totals.items()}
+
+
+def _stored_rollups(conn: sqlite3.Connection) -> Dict[Tuple[str, str, str, str], Tuple[int, int]]:
+    return {
+        (row['username'], row['category'], row['month'], row['status']): (row['count'], row['cents'])
+        for row in conn.execute('SELECT * FROM rollups')
+    }
+
+
+def verify_rollups() -> List[Dict[str, Any]]:
+    """
+    Compare the stored rollups with a full scan of the receipts.
+
+    Returns:
+        One entry per group that differs, with its key and the 'stored' and
+        'expected' (count, cents); empty when the rollups are correct
+    """
+    conn = get_connection()
+    expected = _scan_rollups(conn)
+    stored = _stored_rollups(conn)
+    return [
+        {**dict(zip(ROLLUP_DIMENSIONS, key)), 'stored': stored.get(key), 'expected': expected.get(key)}
+        for key in sorted(set(expected) | set(stored))
+        if stored.get(key) != expected.get(key)
+    ]
+
+
+def rebuild_rollups() -> Dict[str, int]:
+    """
+    Recompute the rollups from a full scan of the receipts.
+
+    Returns:
+        Dictionary with the number of groups and how many were wrong before
+    """
+    with transaction() as conn:
+        expected = _scan_rollups(conn)
+        stored = _stored_rollups(conn)
+        mismatches = sum(
+            stored.get(key) != expected.get(key) for key in set(expected) | set(stored)
+        )
+        conn.execute('DELETE FROM rollups')
+        conn.executemany(
+            'INSERT INTO rollups (username, category, month, status, count, cents) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(*key, count, cents) for key, (count, cents) in expected.items()]
+        )
+    return {'groups': len(expected), 'mismatches': mismatches}
+
+
+# --- Migration from the legacy JSON files -----------------------------------
+
+def migrate_from_json(users_path: str, receipts_path: str) -> bool:
+    """
+    One-shot import of the legacy users.json/receipts.json files.
+
+    The import runs at most once per database; later calls are no-ops so
+    the JSON files can be left in place.
+
+    Args:
+        users_path: Path to the legacy users.json
+        receipts_path: Path to the legacy receipts.json
+
+    Returns:
+        True if data was imported by this call
+    """
+    conn = get_connection()
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+        return False
+
+    users = {}
+    if os.path.exists(users_path):
+        with open(users_path, 'r') as f:
+            users = json.load(f).get('users', {})
+
+    receipts = {}
+    if os.path.exists(receipts_path):
+        with open(receipts_path, 'r') as f:
+            receipts = json.load(f).get('receipts', {})
+
+    with transaction() as conn:
+        for username, user in users.items():
+            conn.execute(
+                'INSERT OR IGNORE INTO users (username, role, data) VALUES (?, ?, ?)',
+                (username, user.get('role', 'user'), json.dumps(user))
+            )
+        for username, user_receipts in receipts.items():
+            for receipt in user_receipts:
+                receipt = normalize_receipt(receipt)
+                _ensure_receipt_id(conn, receipt)
+                image_filename = receipt.get('image_filename')
+                inserted = conn.execute(
+                    f"INSERT OR IGNORE INTO receipts (username, {', '.join(RECEIPT_COLUMNS)}) "
+                    f"VALUES (?, {', '.join('?' * len(RECEIPT_COLUMNS))})",
+                    (username, *_receipt_columns(conn, receipt))
+                ).rowcount
+                if inserted:
+                    _apply_rollup(conn, username, receipt, 1)
+                if image_filename:
+                    conn.execute(
+                        'INSERT OR IGNORE INTO image_owners (image_filename, username) '
+                        'VALUES (?, ?)',
+                        (image_filename, username)
+                    )
+        conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_dir = os.path.join(base_dir, 'database')
+
+    parser = argparse.ArgumentParser(description='EERIS storage maintenance')
+    parser.add_argument('command', choices=['migrate', 'normalize', 'compact', 'reindex-images', 'verify-rollups', 'rebuild-rollups', 'gc-uploads'])
+    parser.add_argument('--db', default=os.path.join(database_dir, 'eeris.db'))
+    parser.add_argument('--dry-run', action='store_true', help='gc-uploads: only report what would be deleted')
+    parser.add_argument('--grace-hours', type=float, help='gc-uploads: override EERIS_UPLOAD_GC_GRACE_HOURS')
+    args = parser.parse_args()
+
+    init_db(args.db)
+    if args.command == 'migrate':
+        imported = migrate_from_json(
+            os.path.join(database_dir, 'users.json'),
+            os.path.join(database_dir, 'receipts.json')
+        )
+        print('Imported legacy JSON data' if imported else 'Database already migrated')
+    elif args.command == 'normalize':
+        print(f"{normalize_receipts()} receipts normalized")
+        print(rebuild_rollups())
+    elif args.command == 'compact':
+        print(compact())
+    elif args.command == 'reindex-images':
+        print(rebuild_image_index())
+    elif args.command == 'verify-rollups':
+        mismatches = verify_rollups()
+        for mismatch in mismatches:
+            print(mismatch)
+        print(f"{len(mismatches)} rollup groups differ from a full scan")
+    elif args.command == 'rebuild-rollups':
+        print(rebuild_rollups())
+    elif args.command == 'gc-uploads':
+        import upload_store
+        grace = args.grace_hours * 3600 if args.grace_hours is not None else None
+        report = upload_store.collect_garbage(referenced_images(), grace, dry_run=args.dry_run)
+        for name in report['files']:
+            print(('would remove ' if args.dry_run else 'removed ') + name)
+        print(f"{report['removed']} of {report['scanned']} files, {report['bytes_reclaimed']} bytes "
+              f"{'reclaimable' if args.dry_run else 'reclaimed'} ({report['referenced']} referenced, "
+              f"{report['within_grace']} within the grace period)")
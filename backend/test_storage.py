@@ -0,0 +1,41 @@
+import storage
+
+
+def _plans(monkeypatch):
+    # Record the query plan of every SELECT query_receipts runs
+    conn = storage.get_connection()
+    plans = []
+
+    class Recorder:
+        def execute(self, sql, params=()):
+            plans.append([row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)])
+            return conn.execute(sql, params)
+
+    monkeypatch.setattr(storage, 'get_connection', Recorder)
+    return plans
+
+
+def test_multi_owner_pages_use_the_sorted_indexes(tmp_path, monkeypatch):
+    storage.init_db(str(tmp_path / 'eeris.db'))
+    for i in range(30):
+        storage.add_receipt('abc'[i % 3], {
+            'processed_at': f'2025-01-01T00:00:{i:02d}',
+            'date': f'2025-01-{i % 28 + 1:02d}',
+            'total_payment': f'${i}.00',
+            'status': 'pending',
+        })
+    plans = _plans(monkeypatch)
+
+    for sort in storage.RECEIPT_SORTS:
+        for descending in (False, True):
+            cursor, seen = None, []
+            while True:
+                page, cursor = storage.query_receipts(['a', 'b', 'c'], statuses=['pending'], sort=sort,
+                                                      descending=descending, limit=4, cursor=cursor)
+                seen.extend(receipt['id'] for receipt in page)
+                if cursor is None:
+                    break
+            assert len(seen) == len(set(seen)) == 30
+
+    assert plans
+    assert not [plan for plan in plans if any('TEMP B-TREE' in step for step in plan)]
@@ -1,8 +1,11 @@
 import json
-from typing import Dict, Any
-from openai import OpenAI
+import os
+import re
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
+from openai_client import chat_completion
+
 # Define the schema for receipt data
 RECEIPT_SCHEMA = {
     "type": "object",
@@ -34,27 +37,290 @@ RECEIPT_SCHEMA = {
     ]
 }
 
-def parse_receipt_text(text: str, api_key: str) -> Dict[str, Any]:
+# How parse_receipt_text extracts fields: 'local' (heuristics only), 'hybrid'
+# (heuristics, then the LLM for low-confidence fields) or 'llm' (LLM only)
+PARSE_MODES = ('local', 'hybrid', 'llm')
+PARSE_MODE = os.getenv('EERIS_PARSE_MODE', 'hybrid')
+# Locally extracted fields below this confidence are sent to the LLM in hybrid mode
+CONFIDENCE_THRESHOLD = float(os.getenv('EERIS_PARSE_CONFIDENCE', '0.8'))
+# Fields that decide whether hybrid mode calls the LLM at all, with the
+# confidence each needs. The others (e.g. a website or category the receipt
+# may simply not have) are only sent along when a call is made anyway.
+REQUIRED_FIELD_THRESHOLDS = {
+    'store_name': CONFIDENCE_THRESHOLD,
+    'date': CONFIDENCE_THRESHOLD,
+    'total_payment': CONFIDENCE_THRESHOLD,
+}
+
+EMPTY_RECEIPT = {
+    'store_name': '',
+    'phone': '',
+    'website': '',
+    'address': '',
+    'date': '',
+    'time': '',
+    'line_items': [],
+    'total_payment': '',
+    'payment_method': '',
+    'expense_category': ''
+}
+
+MONTHS = {name: number for number, names in enumerate([
+    ('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'),
+    ('may',), ('jun', 'june'), ('jul', 'july'), ('aug', 'august'),
+    ('sep', 'sept', 'september'), ('oct', 'october'), ('nov', 'november'), ('dec', 'december')
+], start=1) for name in names}
+
+PHONE_RE = re.compile(r'(?<!\d)(?:\+?1[\s.-]?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}(?!\d)')
+URL_RE = re.compile(
+    r'(?<![@\w.])(?:https?://)?(?:www\.)?[a-z0-9-]+(?:\.[a-z0-9-]+)*\.(?:com|net|org|us|co|io|biz|info)(?:/[^\s]*)?',
+    re.IGNORECASE
+)
+ISO_DATE_RE = re.compile(r'\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b')
+US_DATE_RE = re.compile(r'\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{2,4})\b')
+WORD_DATE_RE = re.compile(r'\b([a-z]{3,9})\.?\s+(\d{1,2}),?\s+(\d{4})\b', re.IGNORECASE)
+TIME_RE = re.compile(r'\b([01]?\d|2[0-3]):([0-5]\d)(?::[0-5]\d)?\s*([ap]\.?m\.?)?', re.IGNORECASE)
+AMOUNT_RE = re.compile(r'\$?\s*(\d{1,6}(?:,\d{3})*\.\d{2})\b')
+TOTAL_RE = re.compile(r'\b(grand\s+total|total\s+due|amount\s+due|balance\s+due|total)\b', re.IGNORECASE)
+NOT_TOTAL_RE = re.compile(r'sub[\s-]?total|total\s+(?:tax|savings|discount|items?)|tax', re.IGNORECASE)
+NOT_ITEM_RE = re.compile(r'\b(paid|change|card|visa|cash|debit|credit|account|balance|amount|tip)\b', re.IGNORECASE)
+STREET_RE = re.compile(
+    r'^\s*\d[\d\s]*\s+.*\b(st|street|ave|avenue|rd|road|blvd|boulevard|dr|drive|ln|lane|way|'
+    r'hwy|highway|pkwy|parkway|ct|court|pl|place|sq|square|cir|circle|suite|ste)\b\.?',
+    re.IGNORECASE
+)
+CITY_LINE_RE = re.compile(r'\b[A-Z]{2}\s+\d{5}(?:-\d{4})?\b')
+PAYMENT_METHODS = [
+    ('apple pay', 'Apple Pay'), ('google pay', 'Google Pay'), ('visa', 'Visa'),
+    ('mastercard', 'Mastercard'), ('master card', 'Mastercard'), ('amex', 'American Express'),
+    ('american express', 'American Express'), ('discover', 'Discover'), ('debit', 'Debit'),
+    ('credit', 'Credit'), ('cash', 'Cash'),
+]
+CATEGORY_KEYWORDS = {
+    'meals': ['restaurant', 'cafe', 'coffee', 'grill', 'pizza', 'burger', 'chicken', 'kitchen',
+              'bar', 'diner', 'subway', 'starbucks', 'mcdonald', 'taco', 'sushi', 'bakery', 'deli'],
+    'travel': ['hotel', 'inn', 'airline', 'airlines', 'flight', 'marriott', 'hilton', 'airbnb',
+               'motel', 'resort', 'boarding'],
+    'transportation': ['uber', 'lyft', 'taxi', 'parking', 'fuel', 'gas', 'shell', 'exxon',
+                       'chevron', 'transit', 'metro', 'toll', 'rental car'],
+    'office supplies': ['office depot', 'staples', 'officemax', 'paper', 'printer', 'toner',
+                        'stationery', 'ink'],
+    'entertainment': ['cinema', 'theatre', 'theater', 'movie', 'music', 'concert', 'tickets',
+                      'netflix', 'spotify'],
+    'training': ['course', 'training', 'seminar', 'workshop', 'udemy', 'coursera', 'conference',
+                 'tuition'],
+}
+
+
+def _format_amount(raw: str) -> str:
+    return f"${float(raw.replace(',', '')):.2f}"
+
+
+def _find_date(text: str) -> Tuple[str, float]:
+    for match in ISO_DATE_RE.finditer(text):
+        year, month, day = (int(g) for g in match.groups())
+        if 1 <= month <= 12 and 1 <= day <= 31:
+            return f"{year:04d}-{month:02d}-{day:02d}", 0.9
+    for match in WORD_DATE_RE.finditer(text):
+        month = MONTHS.get(match.group(1).lower())
+        day, year = int(match.group(2)), int(match.group(3))
+        if month and 1 <= day <= 31:
+            return f"{year:04d}-{month:02d}-{day:02d}", 0.9
+    for match in US_DATE_RE.finditer(text):
+        month, day, year = (int(g) for g in match.groups())
+        if 1 <= month <= 12 and 1 <= day <= 31:
+            # Two-digit years and day/month order are guesses
+            confidence = 0.85 if year >= 1000 else 0.7
+            year = year + 2000 if year < 100 else year
+            return f"{year:04d}-{month:02d}-{day:02d}", confidence
+    return '', 0.0
+
+
+def _find_time(text: str) -> Tuple[str, float]:
+    match = TIME_RE.search(text)
+    if not match:
+        return '', 0.0
+    hour, minute, meridiem = int(match.group(1)), match.group(2), match.group(3)
+    if meridiem:
+        meridiem = meridiem.lower().replace('.', '')
+        if meridiem == 'pm' and hour < 12:
+            hour += 12
+        elif meridiem == 'am' and hour == 12:
+            hour = 0
+    return f"{hour:02d}:{minute}", 0.85
+
+
+def _find_total(lines: List[str]) -> Tuple[str, float]:
+    # Prefer the last explicit TOTAL line; fall back to the largest amount
+    candidates = [line for line in lines if TOTAL_RE.search(line) and not NOT_TOTAL_RE.search(line)]
+    for line in reversed(candidates):
+        amounts = AMOUNT_RE.findall(line)
+        if amounts:
+            return _format_amount(amounts[-1]), 0.9
+    amounts = [float(a.replace(',', '')) for line in lines for a in AMOUNT_RE.findall(line)]
+    if amounts:
+        return f"${max(amounts):.2f}", 0.4
+    return '', 0.0
+
+
+def _find_address(lines: List[str]) -> Tuple[str, float]:
+    for index, line in enumerate(lines[:15]):
+        if STREET_RE.search(line):
+            address = line
+            if index + 1 < len(lines) and CITY_LINE_RE.search(lines[index + 1]):
+                return f"{address}, {lines[index + 1]}", 0.75
+            return address, 0.5
+    for line in lines[:15]:
+        if CITY_LINE_RE.search(line):
+            return line, 0.4
+    return '', 0.0
+
+
+def _find_line_items(lines: List[str]) -> Tuple[List[str], float]:
+    items = []
+    for line in lines:
+        if not AMOUNT_RE.search(line) or TOTAL_RE.search(line) or NOT_TOTAL_RE.search(line):
+            continue
+        name = re.sub(r'\(\s*\)', '', AMOUNT_RE.sub('', line)).strip(' $-:\t')
+        if sum(c.isalpha() for c in name) >= 3 and not NOT_ITEM_RE.search(name):
+            items.append(name)
+    return items, 0.6 if items else 0.0
+
+
+def _find_category(text: str) -> Tuple[str, float]:
+    lowered = text.lower()
+    scores = {
+        category: sum(1 for keyword in keywords if re.search(rf'\b{re.escape(keyword)}', lowered))
+        for category, keywords in CATEGORY_KEYWORDS.items()
+    }
+    category, score = max(scores.items(), key=lambda item: item[1])
+    if not score:
+        return '', 0.0
+    return category, 0.6 if score == 1 else 0.7
+
+
+def extract_fields_locally(text: str) -> Tuple[Dict[str, Any], Dict[str, float]]:
     """
-    Parse receipt text using GPT to extract structured data.
+    Extract receipt fields with regular expressions and simple heuristics.
     
     Args:
         text: Raw OCR text from receipt
-        api_key: OpenAI API key
+        
+    Returns:
+        Tuple of the fields (same keys as RECEIPT_SCHEMA) and a confidence
+        between 0 and 1 for each field
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    fields = dict(EMPTY_RECEIPT)
+    confidence = {field: 0.0 for field in fields}
+    
+    phone = PHONE_RE.search(text)
+    if phone:
+        fields['phone'], confidence['phone'] = phone.group(0).strip(), 0.9
+    
+    for match in URL_RE.finditer(text):
+        url = match.group(0).rstrip('.,)')
+        if not re.match(r'https?://', url, re.IGNORECASE):
+            url = f"https://{url}"
+        fields['website'], confidence['website'] = url, 0.85
+        break
+    
+    fields['date'], confidence['date'] = _find_date(text)
+    fields['time'], confidence['time'] = _find_time(text)
+    fields['total_payment'], confidence['total_payment'] = _find_total(lines)
+    fields['address'], confidence['address'] = _find_address(lines)
+    fields['line_items'], confidence['line_items'] = _find_line_items(lines)
+    fields['expense_category'], confidence['expense_category'] = _find_category(text)
+    
+    lowered = text.lower()
+    for keyword, method in PAYMENT_METHODS:
+        if re.search(rf'\b{keyword}\b', lowered):
+            fields['payment_method'], confidence['payment_method'] = method, 0.8
+            break
+    
+    # The store name is usually the first line that is not an address/contact
+    # line. It is trusted when nothing but a logo (a few letters) precedes
+    # it, or when the receipt's website carries one of its words.
+    first_text_line = True
+    for line in lines[:5]:
+        if sum(c.isalpha() for c in line) < 3:
+            continue
+        if PHONE_RE.search(line) or URL_RE.search(line) or STREET_RE.search(line):
+            first_text_line = False
+            continue
+        if len(line) > 40 or AMOUNT_RE.search(line):
+            score = 0.4
+        else:
+            score = 0.85 if first_text_line else 0.6
+            domain = re.sub(r'^https?://(www\.)?', '', fields['website'].lower()).split('/')[0]
+            if any(len(word) >= 4 and word in domain for word in re.findall(r'[a-z]+', line.lower())):
+                score = 0.9
+        fields['store_name'], confidence['store_name'] = line, score
+        break
+    
+    return fields, confidence
+
+
+def uncertain_fields(confidence: Dict[str, float]) -> List[str]:
+    """
+    Fields hybrid mode should ask the LLM for, given local confidences.
+    
+    Returns:
+        An empty list when every field in REQUIRED_FIELD_THRESHOLDS is
+        confident enough, so the receipt needs no LLM call; otherwise every
+        field below CONFIDENCE_THRESHOLD
+    """
+    if all(confidence.get(field, 0.0) >= threshold
+           for field, threshold in REQUIRED_FIELD_THRESHOLDS.items()):
+        return []
+    return [field for field, score in confidence.items() if score < CONFIDENCE_THRESHOLD]
+
+
+def _finalize_receipt(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    # Ensure all required fields exist with proper defaults
+    result = {**EMPTY_RECEIPT, **parsed}
+    
+    # Ensure proper formatting
+    if result['total_payment'] and not result['total_payment'].startswith('$'):
+        result['total_payment'] = f"${result['total_payment'].strip()}"
+    
+    if result['website'] and not (result['website'].startswith('http://') or result['website'].startswith('https://')):
+        result['website'] = f"https://{result['website']}"
+    
+    return result
+
+
+def parse_receipt_text(text: str, api_key: str, mode: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Parse receipt text into structured data.
+    
+    Args:
+        text: Raw OCR text from receipt
+        api_key: OpenAI API key (unused in 'local' mode)
+        mode: 'local', 'hybrid' or 'llm' (default EERIS_PARSE_MODE)
         
     Returns:
         Dictionary containing extracted receipt fields
     """
-    # Set up OpenAI client
-    client = OpenAI(api_key=api_key)
+    mode = mode or PARSE_MODE
+    if mode not in PARSE_MODES:
+        raise ValueError(f"Unknown parse mode: {mode}")
     
-    # System message to instruct GPT
-    system_msg = f"""You are an assistant that extracts structured data from receipt text.
-        Return ONLY valid JSON matching this exact schema, with no additional text or commentary:
+    if mode == 'llm':
+        return parse_receipt_text_with_llm(text, api_key)
+    
+    fields, confidence = extract_fields_locally(text)
+    uncertain = uncertain_fields(confidence)
+    if mode == 'hybrid' and uncertain:
+        llm_fields = parse_receipt_text_with_llm(text, api_key, fields=uncertain)
+        for field in uncertain:
+            if llm_fields.get(field) or not fields[field]:
+                fields[field] = llm_fields.get(field, fields[field])
+    
+    return _finalize_receipt(fields)
 
-        {json.dumps(RECEIPT_SCHEMA, indent=2)}
 
-        Notes on formatting:
+FORMATTING_NOTES = """Notes on formatting:
         - Phone numbers should contain only numbers, spaces, and -() characters
         - Website URLs must start with http:// or https://
         - Dates must be in YYYY-MM-DD format
@@ -64,6 +330,47 @@ def parse_receipt_text(text: str, api_key: str) -> Dict[str, Any]:
           * Choose the most appropriate category based on the store name and purchased items
           * If none of these categories clearly apply, use an empty string ""
         - Use empty string "" for any fields not found in the receipt"""
+
+# Receipts packed into one request by parse_receipt_texts
+PARSE_BATCH_SIZE = int(os.getenv('EERIS_PARSE_BATCH_SIZE', '8'))
+# Rounds of batched retries for items missing from a response before
+# falling back to one request per receipt
+PARSE_BATCH_ATTEMPTS = 2
+
+
+def _schema_for(fields: Optional[List[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return RECEIPT_SCHEMA
+    return {
+        **RECEIPT_SCHEMA,
+        'properties': {k: v for k, v in RECEIPT_SCHEMA['properties'].items() if k in fields},
+        'required': [k for k in RECEIPT_SCHEMA['required'] if k in fields]
+    }
+
+
+def parse_receipt_text_with_llm(
+    text: str,
+    api_key: str,
+    fields: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Parse receipt text using GPT to extract structured data.
+    
+    Args:
+        text: Raw OCR text from receipt
+        api_key: OpenAI API key
+        fields: Only ask for these schema fields (default all of them)
+        
+    Returns:
+        Dictionary containing extracted receipt fields
+    """
+    # System message to instruct GPT
+    system_msg = f"""You are an assistant that extracts structured data from receipt text.
+        Return ONLY valid JSON matching this exact schema, with no additional text or commentary:
+
+        {json.dumps(_schema_for(fields), indent=2)}
+
+        {FORMATTING_NOTES}"""
     
     # User message with instructions
     user_msg = f"""Extract the receipt data into JSON format following the schema exactly.
@@ -76,7 +383,8 @@ def parse_receipt_text(text: str, api_key: str) -> Dict[str, Any]:
     
     try:
         # Call GPT API
-        response = client.chat.completions.create(
+        response = chat_completion(
+            api_key,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system_msg},
@@ -89,35 +397,134 @@ def parse_receipt_text(text: str, api_key: str) -> Dict[str, Any]:
         json_str = response.choices[0].message.content.strip()
         parsed_data = json.loads(json_str)
         
-        # Ensure all required fields exist with proper defaults
-        required_fields = {
-            'store_name': '',
-            'phone': '',
-            'website': '',
-            'address': '',
-            'date': '',
-            'time': '',
-            'line_items': [],
-            'total_payment': '',
-            'payment_method': '',
-            'expense_category': ''
-        }
+        if fields is not None:
+            return {k: v for k, v in parsed_data.items() if k in fields}
         
         # Update with parsed values, using defaults for missing fields
-        result = {**required_fields, **parsed_data}
-        
-        # Ensure proper formatting
-        if result['total_payment'] and not result['total_payment'].startswith('$'):
-            result['total_payment'] = f"${result['total_payment'].strip()}"
-        
-        if result['website'] and not (result['website'].startswith('http://') or result['website'].startswith('https://')):
-            result['website'] = f"https://{result['website']}"
-        
-        return result
+        return _finalize_receipt(parsed_data)
         
     except Exception as e:
         raise Exception(f"Error parsing receipt text: {str(e)}")
 
+def _parse_batch_with_llm(
+    texts: Dict[int, str],
+    api_key: str,
+    fields: Optional[List[str]] = None
+) -> Dict[int, Dict[str, Any]]:
+    # One request for several receipts. Returns only the items that came back
+    # well-formed; the caller retries the rest.
+    system_msg = f"""You are an assistant that extracts structured data from receipt text.
+        You will receive several receipts, each introduced by a line "### Receipt <index>".
+        Return ONLY a JSON object of the form {{"receipts": [...]}} with no additional text or commentary.
+        It must contain one object per receipt, each with an integer "index" matching its receipt
+        plus the fields of this exact schema:
+
+        {json.dumps(_schema_for(fields), indent=2)}
+
+        {FORMATTING_NOTES}"""
+    
+    user_msg = "Extract the data of each receipt below. For line items, include all purchased items as an array of strings.\n\n"
+    user_msg += "\n\n".join(f"### Receipt {index}\n{text}" for index, text in texts.items())
+    
+    try:
+        response = chat_completion(
+            api_key,
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": system_msg},
+                {"role": "user", "content": user_msg}
+            ],
+            temperature=0.1,
+            response_format={"type": "json_object"}
+        )
+        items = json.loads(response.choices[0].message.content)['receipts']
+    except Exception:
+        return {}
+    
+    results = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or item.get('index') not in texts:
+            continue
+        index = item.pop('index')
+        if fields is not None:
+            results[index] = {k: v for k, v in item.items() if k in fields}
+        else:
+            results[index] = _finalize_receipt(item)
+    return results
+
+def parse_receipt_texts(
+    texts: List[str],
+    api_key: str,
+    mode: Optional[str] = None,
+    batch_size: Optional[int] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Parse several receipts, packing the LLM work for many receipts into each request.
+    
+    The JSON schema is sent once per request instead of once per receipt.
+    Receipts missing or malformed in a response are retried in smaller
+    batches, then one at a time, without re-sending those that succeeded.
+    
+    Args:
+        texts: Raw OCR text of each receipt
+        api_key: OpenAI API key (unused in 'local' mode)
+        mode: 'local', 'hybrid' or 'llm' (default EERIS_PARSE_MODE)
+        batch_size: Receipts per request (default EERIS_PARSE_BATCH_SIZE)
+        
+    Returns:
+        Parsed fields for each text, in input order; None for receipts that
+        could not be parsed
+    """
+    mode = mode or PARSE_MODE
+    if mode not in PARSE_MODES:
+        raise ValueError(f"Unknown parse mode: {mode}")
+    batch_size = batch_size or PARSE_BATCH_SIZE
+    
+    if mode == 'llm':
+        local = [dict(EMPTY_RECEIPT) for _ in texts]
+        wanted = {index: None for index in range(len(texts))}
+    else:
+        extracted = [extract_fields_locally(text) for text in texts]
+        local = [fields for fields, _ in extracted]
+        wanted = {}
+        if mode == 'hybrid':
+            for index, (_, confidence) in enumerate(extracted):
+                uncertain = uncertain_fields(confidence)
+                if uncertain:
+                    wanted[index] = uncertain
+    
+    llm_results = {}
+    pending = list(wanted)
+    for attempt in range(PARSE_BATCH_ATTEMPTS):
+        # Halve the batch on each retry round so one bad receipt hurts fewer others
+        size = max(1, batch_size >> attempt)
+        for start in range(0, len(pending), size):
+            chunk = pending[start:start + size]
+            if mode == 'llm':
+                fields = None
+            else:
+                fields = sorted(set().union(*(wanted[index] for index in chunk)))
+            llm_results.update(_parse_batch_with_llm({i: texts[i] for i in chunk}, api_key, fields))
+        pending = [index for index in pending if index not in llm_results]
+    
+    for index in pending:
+        try:
+            llm_results[index] = parse_receipt_text_with_llm(texts[index], api_key, fields=wanted[index])
+        except Exception:
+            pass
+    
+    results = []
+    for index, fields in enumerate(local):
+        if index in wanted and index not in llm_results:
+            results.append(None)
+            continue
+        llm_fields = llm_results.get(index, {})
+        for field in wanted.get(index) or llm_fields:
+            if llm_fields.get(field) or not fields.get(field):
+                fields[field] = llm_fields.get(field, fields.get(field))
+        results.append(_finalize_receipt(fields))
+    return results
+
 def format_receipt_data(data: Dict[str, Any]) -> None:
     """
     Format and display the parsed receipt data in the terminal.
@@ -0,0 +1,182 @@
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+from pdf2image import convert_from_path
+
+from cache import prune_directory
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Downscaled previews of uploads, one file per upload, size bucket and format
+THUMBNAIL_DIR = os.getenv('EERIS_THUMBNAIL_DIR', os.path.join(BASE_DIR, 'database', 'thumbnails'))
+THUMBNAIL_MAX_BYTES = int(os.getenv('EERIS_THUMBNAIL_MAX_BYTES', str(100 * 1024 * 1024)))
+# Generate every bucket right after an upload is processed, not on first view
+EAGER_THUMBNAILS = os.getenv('EERIS_EAGER_THUMBNAILS', '1') not in ('0', 'false')
+
+# Longest side, in pixels, of each size bucket; requests are rounded up to one
+SIZE_BUCKETS = (160, 480, 1024)
+# Output format: (Pillow format, file extension, MIME type, save options)
+FORMATS = {
+    'webp': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# Enough resolution for the largest bucket on a letter-size page
+PDF_THUMBNAIL_DPI = int(os.getenv('EERIS_PDF_THUMBNAIL_DPI', '100'))
+
+
+def size_bucket(size: Optional[int]) -> int:
+    """
+    Round a requested size up to the nearest bucket, capped at the largest.
+    """
+    if not size:
+        return SIZE_BUCKETS[-1]
+    return next((bucket for bucket in SIZE_BUCKETS if bucket >= size), SIZE_BUCKETS[-1])
+
+
+def thumbnail_path(filename: str, size: int, fmt: str) -> str:
+    """
+    Where the thumbnail of an upload in a given bucket and format is kept.
+    """
+    return os.path.join(THUMBNAIL_DIR, f"{os.path.basename(filename)}.{size}.{FORMATS[fmt][1]}")
+
+
+def mimetype(fmt: str) -> str:
+    return FORMATS[fmt][2]
+
+
+def _open_source(source_path: str, size: int) -> Image.Image:
+    # First page of a PDF, or the image itself, upright and in RGB
+    if source_path.lower().endswith('.pdf'):
+        pages = convert_from_path(source_path, dpi=PDF_THUMBNAIL_DPI, first_page=1, last_page=1,
+                                  use_pdftocairo=True, strict=False)
+        if not pages:
+            raise ValueError(f"No pages in {os.path.basename(source_path)}")
+        image = pages[0]
+    else:
+        image = Image.open(source_path)
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale, far cheaper than a full decode
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        # Flatten transparency onto white rather than black
+        background = Image.new('RGB', image.size, 'white')
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    return image
+
+
+def _write(image: Image.Image, path: str, fmt: str) -> None:
+    pil_format, _, _, options = FORMATS[fmt]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        image.save(tmp_path, pil_format, **options)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _touch(path: str) -> bool:
+    # Bump the access time only: the modification time backs Last-Modified
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def generate_thumbnails(
+    source_path: str,
+    sizes: Tuple[int, ...] = SIZE_BUCKETS,
+    formats: Tuple[str, ...] = tuple(FORMATS)
+) -> List[str]:
+    """
+    Render the thumbnails of an upload that are not on disk yet.
+
+    The source is decoded once; each bucket is scaled down from the next
+    larger one rather than from the full-size original.
+
+    Args:
+        source_path: The uploaded image or PDF
+        sizes: Size buckets to generate
+        formats: Keys of FORMATS to generate
+
+    Returns:
+        Paths of all the requested thumbnails
+    """
+    wanted = [(size, fmt) for size in sorted(sizes, reverse=True) for fmt in formats]
+    paths = {(size, fmt): thumbnail_path(source_path, size, fmt) for size, fmt in wanted}
+    missing = [key for key in wanted if not _touch(paths[key])]
+    if missing:
+        image = _open_source(source_path, missing[0][0])
+        for size, fmt in missing:
+            if max(image.size) > size:
+                image.thumbnail((size, size), Image.LANCZOS)
+            _write(image, paths[(size, fmt)], fmt)
+        # Only finished thumbnails: another request's temp file may be about to be renamed
+        prune_directory(THUMBNAIL_DIR, THUMBNAIL_MAX_BYTES, keep=list(paths.values()),
+                        suffixes=tuple(f'.{extension}' for _, extension, _, _ in FORMATS.values()))
+    return [paths[key] for key in wanted]
+
+
+def get_thumbnail(source_path: str, size: int, fmt: str) -> str:
+    """
+    Return the path of one thumbnail, rendering it on first request.
+
+    Args:
+        source_path: The uploaded image or PDF
+        size: Size bucket, see size_bucket
+        fmt: Key of FORMATS
+
+    Returns:
+        Path of the thumbnail file
+    """
+    return generate_thumbnails(source_path, (size,), (fmt,))[0]
+
+
+def remove_thumbnails(filename: str) -> int:
+    """
+    Delete every thumbnail of an upload, e.g. once the upload itself is gone.
+
+    Returns:
+        Number of files deleted
+    """
+    removed = 0
+    for size in SIZE_BUCKETS:
+        for fmt in FORMATS:
+            try:
+                os.remove(thumbnail_path(filename, size, fmt))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def thumbnail_stage(payload: Dict[str, Any], receipt_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Job stage: pre-render the thumbnails of a processed upload.
+
+    A failure here never fails the job, the thumbnails are then rendered
+    on first request instead.
+
+    Args:
+        payload: The job payload, with the upload's 'filepath'
+        receipt_data: Output of the parse stage, passed through unchanged
+
+    Returns:
+        receipt_data
+    """
+    try:
+        generate_thumbnails(payload['filepath'])
+    except Exception:
+        logger.warning("Could not pre-render thumbnails for %s", payload.get('image_filename'), exc_info=True)
+    return receipt_data
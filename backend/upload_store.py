@@ -0,0 +1,151 @@
+import os
+import re
+import tempfile
+import time
+from typing import Any, BinaryIO, Dict, Iterable, Optional, Tuple
+
+from content_cache import save_and_hash
+from thumbnails import remove_thumbnails
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Uploaded receipts, stored once per distinct content under <hash>.<ext>
+# in two levels of subdirectories taken from the hash
+UPLOAD_DIR = os.getenv('EERIS_UPLOAD_DIR', os.path.join(BASE_DIR, 'database', 'uploads'))
+# Uploads being written, moved into place once their hash is known
+INCOMING_DIR = os.path.join(UPLOAD_DIR, '.incoming')
+# Unreferenced files younger than this are left alone by the garbage
+# collector, so an upload waiting for the user to save its receipt survives
+GC_GRACE_SECONDS = float(os.getenv('EERIS_UPLOAD_GC_GRACE_HOURS', '24')) * 3600
+
+BLOB_NAME_RE = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+
+def blob_path(name: str) -> str:
+    return os.path.join(UPLOAD_DIR, name[:2], name[2:4], name)
+
+
+def resolve(image_filename: str) -> str:
+    """
+    Return the path of an upload from the image_filename stored on its receipt.
+
+    Content-addressed names map into the sharded store; anything else is a
+    legacy upload, kept where it always was at the top of UPLOAD_DIR.
+
+    Raises:
+        ValueError: If the name is not a plain file name
+    """
+    if not image_filename or os.path.basename(image_filename) != image_filename or image_filename.startswith('.'):
+        raise ValueError(f"Invalid upload name: {image_filename!r}")
+    if BLOB_NAME_RE.match(image_filename):
+        return blob_path(image_filename)
+    return os.path.join(UPLOAD_DIR, image_filename)
+
+
+def save_upload(stream: BinaryIO, extension: str) -> Tuple[str, str, str]:
+    """
+    Store an upload under the hash of its content.
+
+    A file identical to one already stored is not kept twice; the stored
+    copy's mtime is refreshed instead, restarting its grace period.
+
+    Args:
+        stream: Readable binary stream
+        extension: File extension, without the dot
+
+    Returns:
+        (image_filename, path, content_hash)
+    """
+    os.makedirs(INCOMING_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=INCOMING_DIR)
+    os.close(fd)
+    try:
+        content_hash = save_and_hash(stream, tmp_path)
+        name = f"{content_hash}.{extension.lower()}"
+        path = blob_path(name)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return name, path, content_hash
+
+
+def _remove_empty_dirs(path: str) -> None:
+    # Prune shard directories left empty, up to but not including UPLOAD_DIR
+    directory = os.path.dirname(path)
+    while os.path.abspath(directory) != os.path.abspath(UPLOAD_DIR):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
+
+
+def collect_garbage(
+    referenced: Iterable[str],
+    grace_seconds: Optional[float] = None,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """
+    Delete uploads no receipt refers to.
+
+    Covers blobs of receipts that were never saved, legacy flat uploads,
+    old team_report_*.pdf files from before reports had their own
+    directory, and abandoned partial writes. Thumbnails of deleted
+    uploads go with them.
+
+    Args:
+        referenced: image_filename of every stored receipt
+        grace_seconds: Minimum age, by mtime, of a file before it may be
+            deleted (default EERIS_UPLOAD_GC_GRACE_HOURS)
+        dry_run: Only report what would be deleted
+
+    Returns:
+        Report with the counts of files scanned, kept because referenced or
+        too recent, and removed, the bytes reclaimed and the removed names
+    """
+    grace = GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    referenced = set(referenced)
+    cutoff = time.time() - grace
+    report = {'dry_run': dry_run, 'scanned': 0, 'referenced': 0, 'within_grace': 0,
+              'removed': 0, 'bytes_reclaimed': 0, 'files': []}
+    if not os.path.isdir(UPLOAD_DIR):
+        return report
+
+    for directory, subdirectories, filenames in os.walk(UPLOAD_DIR):
+        incoming = os.path.abspath(directory) == os.path.abspath(INCOMING_DIR)
+        for filename in filenames:
+            # Keep dotfiles (e.g. .gitkeep) outside the incoming directory
+            if filename.startswith('.') and not incoming:
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            report['scanned'] += 1
+            if filename in referenced and not incoming:
+                report['referenced'] += 1
+                continue
+            if stat.st_mtime > cutoff:
+                report['within_grace'] += 1
+                continue
+
+            report['removed'] += 1
+            report['bytes_reclaimed'] += stat.st_size
+            report['files'].append(os.path.relpath(path, UPLOAD_DIR))
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                if not incoming:
+                    remove_thumbnails(filename)
+                    _remove_empty_dirs(path)
+    return report
@@ -161,20 +161,49 @@ const ChatComponent = () => {
           content: msg.sender === 'user' ? `[User: ${username}] ${msg.text}` : msg.text
         }));
       
-      // Send message and conversation history to backend, including the current user
-      const response = await axios.post('/chat', { 
-        message: userQuery,
-        conversation_history: conversationContext,
-        current_user: username  // Add the current user's username
+      // Stream the answer from the backend, growing the assistant message as tokens arrive
+      const response = await fetch('/chat/stream', {
+        method: 'POST',
+        credentials: 'include',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          message: userQuery,
+          conversation_history: conversationContext,
+          current_user: username  // Add the current user's username
+        })
       });
+      if (!response.ok || !response.body) {
+        throw new Error(`Chat request failed with status ${response.status}`);
+      }
       
-      // Add assistant response to chat
-      const assistantMessage = { 
-        sender: 'assistant', 
-        text: response.data.response,
-        timestamp: new Date().toISOString()
-      };
-      setChatHistory(prev => [...prev, assistantMessage]);
+      const timestamp = new Date().toISOString();
+      setChatHistory(prev => [...prev, { sender: 'assistant', text: '', timestamp }]);
+      const appendText = (text) => setChatHistory(prev => prev.map(msg =>
+        msg.timestamp === timestamp && msg.sender === 'assistant' ? { ...msg, text: msg.text + text } : msg
+      ));
+      
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Server-sent events are separated by a blank line
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}');
+          if (event === 'token') {
+            setIsLoading(false);
+            appendText(data.text);
+          } else if (event === 'error') {
+            throw new Error(data.error);
+          }
+        }
+      }
     } catch (error) {
       console.error('Error sending message:', error);
       const errorMessage = { 
@@ -94,7 +94,10 @@ const EditReceiptModal = ({ open, onClose, receipt, onSave, onReceiptUpdated })
 
   const handleSubmit = async () => {
     try {
-      const response = await axios.post('/update_receipt', {
+      // Receipts saved since ids were introduced (and backfilled ones) are
+      // addressed by id; the timestamp endpoint stays for anything else
+      const url = receipt.id ? `/receipts/${encodeURIComponent(receipt.id)}` : '/update_receipt';
+      const response = await axios.post(url, {
         ...formData,
         username: receipt.username,
         processed_at: receipt.processed_at,
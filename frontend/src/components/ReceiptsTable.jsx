@@ -211,7 +211,7 @@ const ReceiptsTable = ({ receipts, isAdmin, isSupervisor, onViewReceipt, onEditR
         <DataGrid
           rows={receipts.map((receipt, index) => ({
             ...receipt,
-            id: receipt.processed_at || index,
+            id: receipt.id || receipt.processed_at || index,
           }))}
           columns={columns}
           pageSize={10}
@@ -56,6 +56,10 @@ const expenseCategories = [
   'transportation'
 ];
 
+// Background processing: how often and how many times to check the job
+const POLL_INTERVAL_MS = 1000;
+const MAX_POLL_ATTEMPTS = 180;
+
 const UploadModal = ({ open, onClose, onReceiptSaved }) => {
   const [file, setFile] = useState(null);
   const [loading, setLoading] = useState(false);
@@ -81,11 +85,32 @@ const UploadModal = ({ open, onClose, onReceiptSaved }) => {
     formData.append('file', file);
 
     try {
-      const response = await axios.post('/process_receipt', formData);
+      let response = await axios.post('/process_receipt', formData);
+
+      // The receipt is processed in the background: poll the job until it
+      // finishes, then fetch its result
+      if (response.status === 202) {
+        const { job_id: jobId, status_url: statusUrl } = response.data;
+        let status = 'queued';
+        for (let attempt = 0; attempt < MAX_POLL_ATTEMPTS; attempt++) {
+          await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+          const job = await axios.get(statusUrl);
+          status = job.data.status;
+          if (status === 'failed') {
+            throw new Error(job.data.error || 'Failed to process receipt');
+          }
+          if (status === 'done') break;
+        }
+        if (status !== 'done') {
+          throw new Error('Timed out waiting for the receipt to be processed');
+        }
+        response = await axios.get(`/jobs/${jobId}/result`);
+      }
+
       setReceiptData(response.data);
       setLineItems(response.data.line_items || []);
     } catch (error) {
-      setError(error.response?.data?.error || 'Failed to process receipt');
+      setError(error.response?.data?.error || error.message || 'Failed to process receipt');
     } finally {
       setLoading(false);
     }
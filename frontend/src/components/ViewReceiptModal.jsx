@@ -196,7 +196,7 @@ const ViewReceiptModal = ({ open, onClose, receipt, onEdit, userRole, onStatusCh
               ) : (
                 <Box
                   component="img"
-                  src={`http://localhost:5000/uploads/${receipt.image_filename}`}
+                  src={`http://localhost:5000/uploads/${receipt.image_filename}/thumbnail?size=1024`}
                   alt="Receipt"
                   sx={{
                     maxWidth: '100%',
@@ -6,7 +6,8 @@ import {
   Button,
   Box,
   AppBar,
-  Toolbar
+  Toolbar,
+  Alert
 } from '@mui/material';
 import axios from 'axios';
 import UploadModal from '../components/UploadModal';
@@ -15,6 +16,10 @@ import ViewReceiptModal from '../components/ViewReceiptModal';
 import EditReceiptModal from '../components/EditReceiptModal';
 import ChatComponent from '../components/ChatComponent';
 
+// Background team reports: how often and how many times to check the job
+const REPORT_POLL_INTERVAL_MS = 1000;
+const REPORT_MAX_POLL_ATTEMPTS = 300;
+
 const Dashboard = () => {
   const [isUploadModalOpen, setUploadModalOpen] = useState(false);
   const [isViewModalOpen, setViewModalOpen] = useState(false);
@@ -23,6 +28,7 @@ const Dashboard = () => {
   const [selectedReceipt, setSelectedReceipt] = useState(null);
   const [isAdmin, setIsAdmin] = useState(false);
   const [isSupervisor, setIsSupervisor] = useState(false);
+  const [reportError, setReportError] = useState('');
   const navigate = useNavigate();
   const username = sessionStorage.getItem('username');
 
@@ -83,11 +89,42 @@ const Dashboard = () => {
   };
 
   const handleGenerateReport = async () => {
+    setReportError('');
     try {
-      const response = await axios.get('/generate_team_report', {
+      let response = await axios.get('/generate_team_report', {
         responseType: 'blob'
       });
       
+      // Large teams get their report built in the background: wait for the
+      // job, then fetch the finished (now cached) report
+      if (response.status === 202) {
+        const { status_url: statusUrl } = JSON.parse(await response.data.text());
+        let status = 'queued';
+        for (let attempt = 0; attempt < REPORT_MAX_POLL_ATTEMPTS; attempt++) {
+          await new Promise(resolve => setTimeout(resolve, REPORT_POLL_INTERVAL_MS));
+          const job = await axios.get(statusUrl);
+          status = job.data.status;
+          if (status === 'failed') {
+            throw new Error(job.data.error || 'Report generation failed');
+          }
+          if (status === 'done') break;
+          if (status !== 'queued' && status !== 'running') {
+            throw new Error(`Unknown report job status: ${status}`);
+          }
+        }
+        if (status !== 'done') {
+          throw new Error('Timed out waiting for the report');
+        }
+        response = await axios.get('/generate_team_report', {
+          responseType: 'blob'
+        });
+      }
+
+      // Anything but a finished PDF (e.g. another 202) must not be saved as one
+      if (response.status !== 200 || !response.headers['content-type']?.startsWith('application/pdf')) {
+        throw new Error('Report is not ready');
+      }
+      
       // Create a URL for the blob
       const url = window.URL.createObjectURL(new Blob([response.data]));
       
@@ -103,6 +140,7 @@ const Dashboard = () => {
       window.URL.revokeObjectURL(url);
     } catch (error) {
       console.error('Error generating report:', error);
+      setReportError(error.response?.data?.error || error.message || 'Failed to generate report');
     }
   };
 
@@ -192,6 +230,12 @@ const Dashboard = () => {
           )}
         </Box>
 
+        {reportError && (
+          <Alert severity="error" sx={{ mb: 2 }} onClose={() => setReportError('')}>
+            {reportError}
+          </Alert>
+        )}
+
         <Box sx={{ 
           display: 'flex', 
           gap: 4,